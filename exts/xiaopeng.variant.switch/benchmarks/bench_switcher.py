@@ -0,0 +1,189 @@
+"""
+Benchmarks of the variant switcher operations on synthetic stages, with plain usd-core:
+
+    python benchmarks/bench_switcher.py --preset small --out results.json
+    python benchmarks/bench_switcher.py --prims 2000000 --sets 500 --members 5000 --out big.json
+    python benchmarks/bench_switcher.py --preset small --compare results.json
+
+Each operation of the window is timed through the engine it is built on:
+
+    load_cache               list the sets under the cache root (legacy sets are migrated)
+    load_variant_set_cache   read the members of a set and resolve their visibility
+    add_variant_set          pick a free Variant_N name and create the set
+    set_variant_on           activate a member, cycling through the set
+    set_variant_on_warm      switch every member of the set with a warm visibility cache listening
+    drop                     move one member of the set
+    delete_selection_variant remove a tenth of the members of the set
+
+Results are written as json, --compare prints the ratio to a previous run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from pxr import Usd, Sdf  # noqa: E402
+
+from xiaopeng.variant.switch.engine import VariantEngine, VisibilityCache, author_visibility  # noqa: E402
+
+PRESETS = {
+    "small": [(10000, 1, 10), (10000, 10, 100), (100000, 10, 1000)],
+    "full": [
+        (10000, 1, 10),
+        (100000, 10, 100),
+        (100000, 50, 1000),
+        (1000000, 100, 1000),
+        (2000000, 500, 5000),
+    ],
+}
+
+
+def build_stage(prim_count: int, set_count: int, member_count: int, seed: int = 0) -> Usd.Stage:
+    """A stage of prim_count Xforms in groups of 1000, and set_count sets of member_count random members"""
+    layer = Sdf.Layer.CreateAnonymous(".usda")
+    parts = []
+    with Sdf.ChangeBlock():
+        world = Sdf.CreatePrimInLayer(layer, "/World")
+        world.specifier = Sdf.SpecifierDef
+        world.typeName = "Xform"
+        group = None
+        for i in range(prim_count):
+            if i % 1000 == 0:
+                group = Sdf.PrimSpec(world, f"Group_{i // 1000}", Sdf.SpecifierDef, "Xform")
+            part = Sdf.PrimSpec(group, f"Part_{i % 1000}", Sdf.SpecifierDef, "Xform")
+            parts.append(str(part.path))
+
+    stage = Usd.Stage.Open(layer)
+    engine = VariantEngine(stage)
+    rng = random.Random(seed)
+    for i in range(set_count):
+        engine.create_set(f"Set_{i}", rng.sample(parts, min(member_count, len(parts))))
+    return stage
+
+
+def measure(fn, repeat: int):
+    times = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        fn(i)
+        times.append(time.perf_counter() - start)
+    return {"median": statistics.median(times), "min": min(times), "max": max(times), "runs": repeat}
+
+
+def run_case(prim_count: int, set_count: int, member_count: int, repeat: int):
+    start = time.perf_counter()
+    stage = build_stage(prim_count, set_count, member_count)
+    build_seconds = time.perf_counter() - start
+
+    engine = VariantEngine(stage)
+    name = "Set_0"
+    members = engine.members(name)
+    results = {}
+
+    results["load_cache"] = measure(lambda i: engine.load(), repeat)
+
+    def load_variant_set_cache(i):
+        cache = VisibilityCache(stage)
+        cache.get_many(engine.members(name))
+        cache.destroy()
+
+    results["load_variant_set_cache"] = measure(load_variant_set_cache, repeat)
+    results["add_variant_set"] = measure(lambda i: engine.create_set(engine.next_free_name("Variant_")), repeat)
+    results["set_variant_on"] = measure(lambda i: engine.activate(name, i % len(members)), repeat)
+
+    # The window keeps a visibility cache for its lifetime, every stage edit invalidates it
+    cache = VisibilityCache(stage)
+    cache.get_many(members)
+
+    def set_variant_on_warm(i):
+        author_visibility(stage.GetEditTarget(), {path: bool(i % 2) for path in members})
+        cache.get_many(members)
+
+    results["set_variant_on_warm"] = measure(set_variant_on_warm, repeat)
+    cache.destroy()
+    results["drop"] = measure(lambda i: engine.reorder(name, 0, len(members) - 1), repeat)
+
+    def delete_selection_variant(i):
+        current = engine.members(name)
+        engine.remove_members(name, current[:: 10])
+        engine.set_members(name, members)
+
+    results["delete_selection_variant"] = measure(delete_selection_variant, repeat)
+
+    engine.planner.destroy()
+    return {
+        "case": {"prims": prim_count, "sets": set_count, "members": member_count},
+        "build_seconds": build_seconds,
+        "operations": results,
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)), text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, previous_path: str):
+    with open(previous_path) as f:
+        previous = json.load(f)
+    by_case = {json.dumps(_["case"], sort_keys=True): _["operations"] for _ in previous["results"]}
+    print(f"compared to {previous.get('revision')} ({previous_path})")
+    for result in current["results"]:
+        old = by_case.get(json.dumps(result["case"], sort_keys=True))
+        if not old:
+            continue
+        for operation, timing in result["operations"].items():
+            if operation in old:
+                ratio = timing["median"] / old[operation]["median"] if old[operation]["median"] else float("inf")
+                flag = "  <-- slower" if ratio > 1.2 else ""
+                print(f"  {result['case']} {operation:<26} x{ratio:.2f}{flag}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Variant switcher benchmarks on synthetic stages")
+    parser.add_argument("--preset", choices=sorted(PRESETS), help="predefined list of cases")
+    parser.add_argument("--prims", type=int, default=10000)
+    parser.add_argument("--sets", type=int, default=10)
+    parser.add_argument("--members", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", help="json file to write the results to")
+    parser.add_argument("--compare", help="json file of a previous run")
+    args = parser.parse_args()
+
+    cases = PRESETS[args.preset] if args.preset else [(args.prims, args.sets, args.members)]
+    results = []
+    for case in cases:
+        result = run_case(*case, repeat=args.repeat)
+        results.append(result)
+        print(f"{result['case']} built in {result['build_seconds']:.2f}s")
+        for operation, timing in result["operations"].items():
+            print(f"  {operation:<26} {timing['median'] * 1000:10.3f} ms")
+
+    report = {
+        "revision": git_revision(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "usd": ".".join(str(_) for _ in Usd.GetVersion()),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=4)
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    main()
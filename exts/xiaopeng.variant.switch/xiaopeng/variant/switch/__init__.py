@@ -1 +1,9 @@
-from .extension import *
+try:
+    import omni.ext  # noqa: F401
+except ImportError:
+    # Outside of Kit (e.g. plain usd-core) only the pxr modules such as .engine can be imported
+    pass
+else:
+    from .extension import *
+
+    from .window import VariantSwitchWindow
@@ -0,0 +1,37 @@
+from typing import List, Tuple
+from pxr import Usd, Sdf
+
+# Members of a variant set are stored as one string[] attribute on the set prim
+MEMBERS_ATTR = "variantSwitcher:members"
+
+# The previous format stored every member as a child Scope named
+# "___World___Car___Wheel__num__3" (path with "/" replaced, then the position)
+LEGACY_SEPARATOR = "___"
+LEGACY_INDEX = "__num__"
+
+
+def read_members(prim: Usd.Prim) -> List[str]:
+    """Member prim paths of a variant set, in order"""
+    attr = prim.GetAttribute(MEMBERS_ATTR)
+    members = attr.Get() if attr else None
+    return list(members) if members else []
+
+
+def is_legacy(prim: Usd.Prim) -> bool:
+    """True when the set still stores its members as child prims"""
+    return any(LEGACY_INDEX in child.GetName() for child in prim.GetAllChildren())
+
+
+def decode_legacy(prim: Usd.Prim) -> Tuple[List[str], List[Sdf.Path]]:
+    """Returns the member paths of a legacy set in order and the child prims that stored them"""
+    entries = []
+    for child in prim.GetAllChildren():
+        name, sep, index = child.GetName().rpartition(LEGACY_INDEX)
+        if not sep:
+            continue
+        path = "/".join(name.split(LEGACY_SEPARATOR))
+        entries.append((int(index) if index.isdigit() else 0, path, child.GetPath()))
+
+    # Stable sort, so duplicated indices keep the child order
+    entries.sort(key=lambda _: _[0])
+    return [_[1] for _ in entries], [_[2] for _ in entries]
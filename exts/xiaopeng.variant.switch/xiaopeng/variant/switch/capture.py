@@ -0,0 +1,129 @@
+import ctypes
+import os
+import threading
+import time
+import carb
+import carb.settings
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Dict, List, Tuple
+from omni.kit.viewport.utility import capture_viewport_to_buffer
+from .scheduler import SETTINGS_PATH
+from .profiling import span, recorder
+
+
+def _buffer_to_bytes(buffer, buffer_size: int) -> bytes:
+    """Copy the content of the PyCapsule handed out by the viewport capture"""
+    ctypes.pythonapi.PyCapsule_GetPointer.restype = ctypes.POINTER(ctypes.c_byte * buffer_size)
+    ctypes.pythonapi.PyCapsule_GetPointer.argtypes = [ctypes.py_object, ctypes.c_char_p]
+    content = ctypes.pythonapi.PyCapsule_GetPointer(buffer, None)
+    return bytes(content.contents)
+
+
+def _encode(path: str, data: bytes, width: int, height: int):
+    from PIL import Image
+
+    if len(data) != width * height * 4:
+        raise ValueError(f"unsupported capture format: {len(data)} bytes for {width}x{height}")
+    with span("variant_switcher.batch.write", label=os.path.basename(path)):
+        Image.frombytes("RGBA", (width, height), data).save(path)
+
+
+class CaptureWriter:
+    """
+    Captures the viewport into memory and hands the frame to a pool of worker
+    threads that encode and write the image, so the next variant can be
+    switched and rendered while the previous one is written.
+
+    At most `max_pending` frames are in flight, `can_accept` is the back pressure.
+    Written files are collected in `written`, failures per file in `errors`.
+    A frame the viewport doesn't hand over within `timeout` seconds fails once
+    `expire` is called, so the callers never wait for it forever.
+    """
+
+    def __init__(self, max_workers=None, max_pending=None, timeout=None):
+        settings = carb.settings.get_settings()
+        max_workers = max_workers or settings.get(f"{SETTINGS_PATH}/writerThreads") or 4
+        self.max_pending = max_pending or settings.get(f"{SETTINGS_PATH}/maxPendingFrames") or 8
+        self.timeout = timeout or settings.get(f"{SETTINGS_PATH}/captureTimeoutSeconds") or 10.0
+
+        self.written: List[str] = []
+        self.errors: List[Tuple[str, str]] = []
+        self._taken = 0
+        self._pending = 0
+        # Path -> time of the request, until the viewport hands the frame over
+        self._requested: Dict[str, float] = {}
+        self._destroyed = False
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="VariantCapture")
+
+    def destroy(self):
+        with self._lock:
+            # Frames handed over from now on are dropped
+            self._destroyed = True
+        self._executor.shutdown(wait=True)
+
+    @property
+    def busy(self) -> bool:
+        with self._lock:
+            return self._pending > 0
+
+    @property
+    def capturing(self) -> bool:
+        """True until the viewport handed the requested frame over, the variant must stay on screen"""
+        with self._lock:
+            return bool(self._requested)
+
+    def take_written(self) -> List[str]:
+        """The files written since the previous call"""
+        with self._lock:
+            written = self.written[self._taken:]
+            self._taken = len(self.written)
+        return written
+
+    def can_accept(self) -> bool:
+        with self._lock:
+            return self._pending < self.max_pending
+
+    def capture(self, viewport_api, path: str):
+        with self._lock:
+            self._pending += 1
+            self._requested[path] = time.perf_counter()
+        capture_viewport_to_buffer(viewport_api, partial(self._on_capture, path))
+
+    def expire(self) -> List[str]:
+        """Fail the frames requested more than `timeout` seconds ago and not handed over, returns their paths"""
+        now = time.perf_counter()
+        with self._lock:
+            expired = [path for path, requested in self._requested.items() if now - requested >= self.timeout]
+            for path in expired:
+                del self._requested[path]
+        for path in expired:
+            self._done(path, TimeoutError(f"no frame from the viewport after {self.timeout:.0f}s"))
+        return expired
+
+    def _on_capture(self, path, buffer, buffer_size, width, height, format):
+        with self._lock:
+            requested = self._requested.pop(path, None)
+            if self._destroyed or requested is None:
+                # Too late: the frame expired or the writer is gone
+                return
+        # From the request to the frame handed over, the frame is rendered in between
+        recorder.record("variant_switcher.batch.capture", time.perf_counter() - requested, os.path.basename(path))
+        try:
+            data = _buffer_to_bytes(buffer, buffer_size)
+            future = self._executor.submit(_encode, path, data, width, height)
+        except Exception as e:
+            self._done(path, e)
+            return
+        future.add_done_callback(lambda f, path=path: self._done(path, f.exception()))
+
+    def _done(self, path: str, error):
+        with self._lock:
+            self._pending -= 1
+            if error is None:
+                self.written.append(path)
+            else:
+                self.errors.append((path, str(error)))
+        if error is not None:
+            carb.log_error(f"[xiaopeng.variant.switch] failed to write {path}: {error}")
@@ -0,0 +1,352 @@
+import abc
+import omni.kit.commands
+import omni.usd
+from typing import Dict, List
+from pxr import Usd, Sdf
+from .engine import author_visibility, restore_visibility, author_members, move_member, bake_variant_sets
+from .engine import SwitchLayer, commit_switch_layer, switch_payloads, restore_payloads
+from .engine import VariantEngine, DEFAULT_CACHE_ROOT
+
+
+def _copy_spec(layer: Sdf.Layer, spec_path: Sdf.Path):
+    """Copy of a prim spec and its descendants in an anonymous layer, None when the layer has no such spec"""
+    if not layer.GetPrimAtPath(spec_path):
+        return None
+    snapshot = Sdf.Layer.CreateAnonymous()
+    Sdf.CreatePrimInLayer(snapshot, spec_path)
+    Sdf.CopySpec(layer, spec_path, snapshot, spec_path)
+    return snapshot
+
+
+def _restore_spec(layer: Sdf.Layer, spec_path: Sdf.Path, snapshot):
+    """Put back a prim spec copied by _copy_spec, or remove the spec when there was none"""
+    if snapshot:
+        Sdf.CopySpec(snapshot, spec_path, layer, spec_path)
+    elif layer.GetPrimAtPath(spec_path):
+        edit = Sdf.BatchNamespaceEdit()
+        edit.Add(spec_path, Sdf.Path.emptyPath)
+        layer.Apply(edit)
+
+
+_VARIANT_FIELDS = ("variantSetNames", "variantSelection")
+
+
+def _copy_variant_sets(layer: Sdf.Layer, spec_path: Sdf.Path, names: List[str]):
+    """
+    Copy of the variant set names and selections of a prim spec and of its variant sets `names`,
+    in an anonymous layer. None when the layer has no such spec.
+    """
+    spec = layer.GetPrimAtPath(spec_path)
+    if not spec:
+        return None
+    snapshot = Sdf.Layer.CreateAnonymous()
+    snapshot_spec = Sdf.CreatePrimInLayer(snapshot, spec_path)
+    for field in _VARIANT_FIELDS:
+        if spec.HasInfo(field):
+            snapshot_spec.SetInfo(field, spec.GetInfo(field))
+    for name in names:
+        if name in spec.variantSets:
+            variant_set_path = spec_path.AppendVariantSelection(name, "")
+            Sdf.CopySpec(layer, variant_set_path, snapshot, variant_set_path)
+    return snapshot
+
+
+def _restore_variant_sets(layer: Sdf.Layer, spec_path: Sdf.Path, names: List[str], snapshot):
+    """Put back the variant sets copied by _copy_variant_sets, the other variant sets of the spec are kept"""
+    spec = layer.GetPrimAtPath(spec_path)
+    if not spec:
+        return
+    snapshot_spec = snapshot.GetPrimAtPath(spec_path)
+    for field in _VARIANT_FIELDS:
+        if snapshot_spec.HasInfo(field):
+            spec.SetInfo(field, snapshot_spec.GetInfo(field))
+        else:
+            spec.ClearInfo(field)
+    for name in names:
+        if name in spec.variantSets:
+            del spec.variantSets[name]
+        if name in snapshot_spec.variantSets:
+            variant_set_path = spec_path.AppendVariantSelection(name, "")
+            Sdf.CopySpec(snapshot, variant_set_path, layer, variant_set_path)
+
+
+def _first_missing_spec(layer: Sdf.Layer, spec_path: Sdf.Path) -> Sdf.Path:
+    """Outermost prefix of spec_path without a spec in the layer, the empty path when spec_path has one"""
+    missing = Sdf.Path.emptyPath
+    path = spec_path
+    while path != Sdf.Path.absoluteRootPath and not layer.GetPrimAtPath(path):
+        missing = path
+        path = path.GetParentPath()
+    return missing
+
+
+class SetVariantVisibilityCommand(omni.kit.commands.Command):
+    """
+    Set the visibility of many prims in one Sdf.ChangeBlock, as a single undo entry.
+
+    Args:
+        visibility: prim path -> True for 'inherited', False for 'invisible'
+    """
+
+    def __init__(self, visibility: Dict[str, bool], stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._visibility = visibility
+        self._edit_target = self._stage.GetEditTarget()
+        self._prev = {}
+
+    def do(self):
+        self._prev = author_visibility(self._edit_target, self._visibility)
+
+    def undo(self):
+        restore_visibility(self._edit_target, self._prev)
+        self._prev = {}
+
+
+class SwitchVariantPayloadsCommand(omni.kit.commands.Command):
+    """
+    Load the payloads of the active member of a variant set and unload those of the
+    other members, in one Stage.LoadAndUnload.
+
+    Args:
+        members: member prim paths of the set
+        target: the active member
+    """
+
+    def __init__(self, members: List[str], target: str, stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._members = members
+        self._target = target
+        self._loaded = []
+
+    def do(self):
+        self._loaded = switch_payloads(self._stage, self._members, self._target)
+
+    def undo(self):
+        restore_payloads(self._stage, self._members, self._loaded)
+        self._loaded = []
+
+
+class SetVariantSetMembersCommand(omni.kit.commands.Command):
+    """
+    Replace the member list of a variant set, stored on the set prim.
+
+    Args:
+        set_path: path of the variant set prim under the cache root
+        members: member prim paths, in order
+    """
+
+    def __init__(self, set_path: str, members: List[str], stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._set_path = Sdf.Path(set_path)
+        self._members = members
+        self._edit_target = self._stage.GetEditTarget()
+        self._prev = None
+
+    def do(self):
+        self._prev = author_members(self._edit_target, self._set_path, self._members)
+
+    def undo(self):
+        author_members(self._edit_target, self._set_path, self._prev)
+        self._prev = None
+
+
+class MoveVariantSetMemberCommand(omni.kit.commands.Command):
+    """
+    Move one member of a variant set to another position of the member list.
+
+    Args:
+        set_path: path of the variant set prim under the cache root
+        source_index: current position of the member
+        target_index: position of the member once moved
+    """
+
+    def __init__(self, set_path: str, source_index: int, target_index: int, stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._set_path = Sdf.Path(set_path)
+        self._source_index = source_index
+        self._target_index = target_index
+        self._edit_target = self._stage.GetEditTarget()
+
+    def do(self):
+        move_member(self._stage, self._edit_target, self._set_path, self._source_index, self._target_index)
+
+    def undo(self):
+        move_member(self._stage, self._edit_target, self._set_path, self._target_index, self._source_index)
+
+
+class BakeVariantSetsCommand(omni.kit.commands.Command):
+    """
+    Author variant switcher sets as native UsdVariantSets on a prim.
+
+    The variant sets of the target prim spec that the bake authors are copied
+    before baking and put back on undo, the rest of the target is not copied.
+
+    Args:
+        sets: set name -> member prim paths
+        target_path: prim that receives the variant sets, ancestor of every member
+        clear_local_visibility: remove the member visibility opinions that would override the variants
+    """
+
+    def __init__(self, sets: Dict[str, List[str]], target_path: str, clear_local_visibility=True,
+                 stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._sets = sets
+        self._target_path = Sdf.Path(target_path)
+        self._clear_local_visibility = clear_local_visibility
+        self._edit_target = self._stage.GetEditTarget()
+        self._snapshot = None
+        self._created = Sdf.Path.emptyPath
+        self._removed = {}
+
+    def do(self):
+        layer = self._edit_target.GetLayer()
+        spec_path = self._edit_target.MapToSpecPath(self._target_path)
+        self._snapshot = _copy_variant_sets(layer, spec_path, list(self._sets))
+        # The target and its ancestors are created in the layer when it has no opinion on them yet
+        self._created = _first_missing_spec(layer, spec_path)
+
+        with Usd.EditContext(self._stage, self._edit_target):
+            self._removed = bake_variant_sets(self._stage, self._sets, self._target_path, self._clear_local_visibility)
+
+    def undo(self):
+        layer = self._edit_target.GetLayer()
+        spec_path = self._edit_target.MapToSpecPath(self._target_path)
+        with Sdf.ChangeBlock():
+            if self._snapshot:
+                _restore_variant_sets(layer, spec_path, list(self._sets), self._snapshot)
+            elif not self._created.isEmpty:
+                _restore_spec(layer, self._created, None)
+            restore_visibility(self._edit_target, self._removed)
+        self._snapshot = None
+        self._created = Sdf.Path.emptyPath
+        self._removed = {}
+
+
+class CommitSwitchLayerCommand(omni.kit.commands.Command):
+    """
+    Author the visibility of the switch layer on the edit target and clear the switch layer.
+
+    Args:
+        switch_layer: session sublayer that received the switch edits
+    """
+
+    def __init__(self, switch_layer: SwitchLayer, stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._switch_layer = switch_layer
+        self._edit_target = self._stage.GetEditTarget()
+        self._prev = {}
+        self._snapshot = None
+
+    def do(self):
+        self._prev, self._snapshot = commit_switch_layer(self._switch_layer, self._edit_target)
+
+    def undo(self):
+        with Sdf.ChangeBlock():
+            restore_visibility(self._edit_target, self._prev)
+            # Without the layer, when the session layer mode was turned off since, only the edit target is restored
+            if self._switch_layer.layer is not None:
+                self._switch_layer.layer.TransferContent(self._snapshot)
+        self._prev = {}
+        self._snapshot = None
+
+
+class _VariantCacheEdit(abc.ABC):
+    """
+    Do and undo of the commands that edit the variant sets through the VariantEngine, it is
+    not a command itself. The cache root spec of the edit layer is copied before the edit and
+    put back on undo.
+    """
+
+    def __init__(self, cache_root: str = DEFAULT_CACHE_ROOT, stage: Usd.Stage = None):
+        self._stage = stage or omni.usd.get_context().get_stage()
+        self._cache_root = Sdf.Path(cache_root)
+        self._edit_target = self._stage.GetEditTarget()
+        self._snapshot = None
+
+    def do(self):
+        self._snapshot = _copy_spec(self._edit_target.GetLayer(), self._spec_path())
+        with Usd.EditContext(self._stage, self._edit_target):
+            self._edit(VariantEngine(self._stage, str(self._cache_root)))
+
+    def undo(self):
+        with Sdf.ChangeBlock():
+            _restore_spec(self._edit_target.GetLayer(), self._spec_path(), self._snapshot)
+        self._snapshot = None
+
+    def _spec_path(self) -> Sdf.Path:
+        return self._edit_target.MapToSpecPath(self._cache_root)
+
+    @abc.abstractmethod
+    def _edit(self, engine: VariantEngine):
+        """The edit of the command on the variant sets"""
+
+
+class CreateVariantSetCommand(_VariantCacheEdit, omni.kit.commands.Command):
+    """
+    Create a variant set under the cache root, and the cache root when it doesn't exist.
+
+    Args:
+        name: name of the set
+        members: member prim paths, in order
+        cache_root: path of the cache root prim
+    """
+
+    def __init__(self, name: str, members: List[str] = (), cache_root: str = DEFAULT_CACHE_ROOT,
+                 stage: Usd.Stage = None):
+        super().__init__(cache_root, stage)
+        self._name = name
+        self._members = list(members)
+
+    def _edit(self, engine: VariantEngine):
+        engine.create_set(self._name, self._members)
+
+
+class DeleteVariantSetsCommand(_VariantCacheEdit, omni.kit.commands.Command):
+    """
+    Delete variant sets.
+
+    Args:
+        names: names of the sets
+        remove_empty_root: delete the cache root as well once it has no set left
+        cache_root: path of the cache root prim
+    """
+
+    def __init__(self, names: List[str], remove_empty_root=False, cache_root: str = DEFAULT_CACHE_ROOT,
+                 stage: Usd.Stage = None):
+        super().__init__(cache_root, stage)
+        self._names = list(names)
+        self._remove_empty_root = remove_empty_root
+
+    def _edit(self, engine: VariantEngine):
+        engine.delete_sets(self._names, self._remove_empty_root)
+
+
+class RenameVariantSetCommand(_VariantCacheEdit, omni.kit.commands.Command):
+    """
+    Rename a variant set.
+
+    Args:
+        name: current name of the set
+        new_name: name of the set once renamed, not used by another set
+        cache_root: path of the cache root prim
+    """
+
+    def __init__(self, name: str, new_name: str, cache_root: str = DEFAULT_CACHE_ROOT, stage: Usd.Stage = None):
+        super().__init__(cache_root, stage)
+        self._name = name
+        self._new_name = new_name
+
+    def _edit(self, engine: VariantEngine):
+        engine.rename_set(self._name, self._new_name)
+
+
+class MigrateVariantSetsCommand(_VariantCacheEdit, omni.kit.commands.Command):
+    """
+    Convert the sets that store one Scope prim per member into the member list attribute.
+
+    Args:
+        cache_root: path of the cache root prim
+    """
+
+    def _edit(self, engine: VariantEngine):
+        engine.migrate_legacy()
@@ -8,6 +8,7 @@ import os
 from .style import STOP_BUTTON, BUTTON, STRING_FIELD, TOOL_BUTTON
 from omni.kit.widget.stage import StageWidget
 from omni.kit.widget.stage import StageIcons
+from .profiling import profile
 
 class VariantSetEditableDelegate(ui.AbstractItemDelegate):
     """
@@ -15,9 +16,10 @@ class VariantSetEditableDelegate(ui.AbstractItemDelegate):
     of the delegate to create custom widgets for each item.
     """
 
-    def __init__(self):
+    def __init__(self, engine_fn):
         super().__init__()
         self.subscription = None
+        self._engine_fn = engine_fn
         self.variant_set_name = None
         self.variant_set_path = "/VariantSwitcherCache"
 
@@ -50,47 +52,68 @@ class VariantSetEditableDelegate(ui.AbstractItemDelegate):
         )
         self.variant_set_name = label.text
 
+    @profile("variant_switcher.rename")
     def on_end_edit(self, model, field, label):
         """Called when the user is editing the item and pressed Enter or clicked outside of the item"""
-        def find_prims_by_name(prim_name: str):
-            stage = omni.usd.get_context().get_stage()
-            found_prims = [x for x in stage.Traverse() if x.GetName() == prim_name]
-            return found_prims
-        
-        if len(find_prims_by_name(field.model.get_value_as_string())) == 0:
-            if not field.model.get_value_as_string().isdigit():
-                if self.variant_set_name != model.as_string:
-                    field.visible = False
-                    label.text = model.as_string
-                    self.subscription = None
-                    
-                    omni.kit.commands.execute('MovePrim',
-                        path_from=f'{self.variant_set_path}/{self.variant_set_name}',
-                        path_to=f'{self.variant_set_path}/{model.as_string}')
-                    
-                    self.variant_set_name = None
-                field.visible = False
-                self.subscription = None
-            else:
-                model.set_value(label.text) 
-                field.visible = False
-                self.subscription = None
+        new_name = model.as_string
+        field.visible = False
+        self.subscription = None
+
+        if new_name == self.variant_set_name:
+            self.variant_set_name = None
+            return
+
+        # Set names only have to be unique among the children of the cache root
+        engine = self._engine_fn()
+        renamed = False
+        if engine.is_free_name(new_name):
+            renamed, _ = omni.kit.commands.execute('RenameVariantSet',
+                name=self.variant_set_name,
+                new_name=new_name,
+                cache_root=str(engine.cache_root))
+
+        # The label only shows the new name once the set has it
+        if renamed:
+            label.text = new_name
         else:
-            model.set_value(label.text) 
-            field.visible = False
-            self.subscription = None
+            model.set_value(label.text)
+        self.variant_set_name = None
+
+
 
+# Icon urls are looked up once and shared by every row
+_CHECK_ICONS = {}
+
+
+def get_check_icon(checked: bool) -> str:
+    if not _CHECK_ICONS:
+        icons = StageIcons()
+        _CHECK_ICONS[True] = icons.get("check_on")
+        _CHECK_ICONS[False] = icons.get("check_off")
+    return _CHECK_ICONS[bool(checked)]
 
 
 class EditableDelegate(ui.AbstractItemDelegate):
     """
     Delegate is the representation layer. TreeView calls the methods
     of the delegate to create custom widgets for each item.
+
+    Every row is a fixed height ui.Frame whose content is only built when
+    the frame is drawn, so long lists only build the rows scrolled into view.
+    With thumbnail_fn(item) returning the thumbnail file of a member (or None),
+    the rows are taller and show it: only the visible rows look thumbnails up.
+    switched_fn(item) is called after a member is switched on by a double click.
     """
 
-    def __init__(self):
+    ROW_HEIGHT = 20
+    THUMBNAIL_WIDTH = 64
+    THUMBNAIL_HEIGHT = 36
+
+    def __init__(self, thumbnail_fn=None, switched_fn=None):
         super().__init__()
-        self.subscription = None
+        self._thumbnail_fn = thumbnail_fn
+        self._switched_fn = switched_fn
+        self.row_height = self.THUMBNAIL_HEIGHT + 4 if thumbnail_fn else self.ROW_HEIGHT
 
     def build_branch(self, model, item, column_id, level, expanded):
         """Create a branch widget that opens or closes subtree"""
@@ -98,25 +121,37 @@ class EditableDelegate(ui.AbstractItemDelegate):
 
     def build_widget(self, model, item, column_id, level, expanded):
         """Create a widget per column per item"""
+        # The build function is deferred until the row becomes visible
+        ui.Frame(height=self.row_height, build_fn=lambda model=model, item=item: self._build_row(model, item))
+
+    def _build_row(self, model, item):
         def on_value_changed(m):
             visible_btn.checked = m.get_value_as_bool()
-            visible_btn.image_url = StageIcons().get("check_off" if not visible_btn.checked else "check_on")
+            visible_btn.image_url = get_check_icon(visible_btn.checked)
 
-        stack = ui.HStack(height=20, width=20, style=TOOL_BUTTON)
+        stack = ui.HStack(height=self.row_height, width=20, style=TOOL_BUTTON)
         with stack:
             ui.Spacer(width=5)
+            if self._thumbnail_fn:
+                thumbnail = self._thumbnail_fn(item)
+                if thumbnail:
+                    ui.Image(thumbnail, width=self.THUMBNAIL_WIDTH, height=self.THUMBNAIL_HEIGHT)
+                else:
+                    ui.Spacer(width=self.THUMBNAIL_WIDTH)
+                ui.Spacer(width=5)
             name_model = model.get_item_value_model(item, 0)
             value_model = model.get_item_value_model(item, 1)
             label = ui.Label(name_model.as_string, width=350)
             visible_btn = ui.ToolButton(value_model, 
                                         enabled=False,
-                                        image_url=StageIcons().get("check_off" if value_model.get_value_as_bool() else "check_on")  ,
+                                        image_url=get_check_icon(value_model.get_value_as_bool()),
                                         image_width=15,
                                         image_height=15,
                                         name='tool_button')
         stack.set_mouse_double_clicked_fn(lambda x, y, b, m, model=model, l=label, item=item, visible_btn=visible_btn, value_model=value_model: self.on_double_click(b, model, l, item, visible_btn, value_model))
-        self.subscription = value_model.add_value_changed_fn(on_value_changed)
-        
+        # One subscription per row, kept by the item: a rebuilt row replaces it
+        # and it goes away with the item when it leaves the model
+        item.value_subscription = value_model.subscribe_value_changed_fn(on_value_changed)
 
     def on_double_click(self, button, model, label, item, visible_btn, value_model):
         """Called when the user double-clicked the item in TreeView"""
@@ -124,4 +159,5 @@ class EditableDelegate(ui.AbstractItemDelegate):
             return
               
         model.set_variant_on(item)
-        
\ No newline at end of file
+        if self._switched_fn:
+            self._switched_fn(item)
@@ -0,0 +1,784 @@
+"""
+Variant switching logic on plain pxr, usable without Kit (e.g. with usd-core on farm nodes).
+
+The Kit commands and the window are adapters over the functions and the
+VariantEngine class of this module.
+"""
+import json
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Iterable, Iterator, List, Sequence, Tuple, Union
+from pxr import Usd, Sdf, Tf, UsdGeom
+from .cache import MEMBERS_ATTR, read_members, is_legacy, decode_legacy
+
+DEFAULT_CACHE_ROOT = "/VariantSwitcherCache"
+
+# Returned by author_default when the layer had no attribute spec at all
+NO_SPEC = object()
+
+
+def author_default(layer: Sdf.Layer, attr_path: Sdf.Path, type_name, value, custom=False):
+    """
+    Author the default value of an attribute on a layer and return the previous opinion.
+    None clears the opinion, NO_SPEC removes the attribute spec.
+    """
+    attr_spec = layer.GetAttributeAtPath(attr_path)
+    if not attr_spec:
+        prev = NO_SPEC
+    else:
+        prev = attr_spec.default if attr_spec.HasDefaultValue() else None
+
+    if value is NO_SPEC:
+        if attr_spec:
+            attr_spec.owner.RemoveProperty(attr_spec)
+        return prev
+
+    if value is None:
+        if attr_spec:
+            attr_spec.ClearDefaultValue()
+        return prev
+
+    if not attr_spec:
+        prim_spec = Sdf.CreatePrimInLayer(layer, attr_path.GetPrimPath())
+        attr_spec = Sdf.AttributeSpec(prim_spec, attr_path.name, type_name, declaresCustom=custom)
+    attr_spec.default = value
+    return prev
+
+
+def author_visibility(edit_target: Usd.EditTarget, visibility: Dict[str, bool]) -> Dict[Sdf.Path, object]:
+    """
+    Author visibility for many prims in one Sdf.ChangeBlock.
+    visibility maps a prim path to True for 'inherited' and False for 'invisible'.
+    Returns the previous opinions, to be given to restore_visibility.
+    """
+    layer = edit_target.GetLayer()
+    prev = {}
+    with Sdf.ChangeBlock():
+        for path, visible in visibility.items():
+            attr_path = edit_target.MapToSpecPath(Sdf.Path(path)).AppendProperty(UsdGeom.Tokens.visibility)
+            value = UsdGeom.Tokens.inherited if visible else UsdGeom.Tokens.invisible
+            prev[attr_path] = author_default(layer, attr_path, Sdf.ValueTypeNames.Token, value)
+    return prev
+
+
+def restore_visibility(edit_target: Usd.EditTarget, prev: Dict[Sdf.Path, object]):
+    """Put back the opinions returned by author_visibility"""
+    layer = edit_target.GetLayer()
+    with Sdf.ChangeBlock():
+        for attr_path, value in prev.items():
+            author_default(layer, attr_path, Sdf.ValueTypeNames.Token, value)
+
+
+def author_members(edit_target: Usd.EditTarget, set_path: Union[str, Sdf.Path], members):
+    """Author the member list of a variant set, returns the previous opinion"""
+    attr_path = edit_target.MapToSpecPath(Sdf.Path(set_path)).AppendProperty(MEMBERS_ATTR)
+    value = list(members) if isinstance(members, (list, tuple)) else members
+    return author_default(edit_target.GetLayer(), attr_path, Sdf.ValueTypeNames.StringArray, value, custom=True)
+
+
+def move_member(stage: Usd.Stage, edit_target: Usd.EditTarget, set_path, source_index: int, target_index: int):
+    """Move one entry of the member list of a variant set"""
+    members = read_members(stage.GetPrimAtPath(Sdf.Path(set_path)))
+    members.insert(target_index, members.pop(source_index))
+    author_members(edit_target, set_path, members)
+
+
+def activation(members: Iterable[str], member: str) -> Dict[str, bool]:
+    """Visibility of every member when `member` is the active variant"""
+    return {path: path == member for path in members}
+
+
+def clear_visibility(edit_target: Usd.EditTarget, paths: Iterable[str]) -> Dict[Sdf.Path, object]:
+    """Remove the visibility opinions of prims, returns them for restore_visibility"""
+    layer = edit_target.GetLayer()
+    prev = {}
+    with Sdf.ChangeBlock():
+        for path in paths:
+            attr_path = edit_target.MapToSpecPath(Sdf.Path(path)).AppendProperty(UsdGeom.Tokens.visibility)
+            prev[attr_path] = author_default(layer, attr_path, Sdf.ValueTypeNames.Token, NO_SPEC)
+    return prev
+
+
+def switch_payloads(stage: Usd.Stage, members: Iterable[str], target: str) -> List[Sdf.Path]:
+    """
+    Load the payloads at or under `target` and unload those of the other members, in a single
+    Stage.LoadAndUnload. Returns the loaded payload paths of the members before, for restore_payloads.
+    """
+    members = {Sdf.Path(_) for _ in members}
+    target = Sdf.Path(target)
+    before = [path for path in stage.GetLoadSet() if any(_ in members for _ in path.GetPrefixes())]
+    stage.LoadAndUnload({target}, members - {target})
+    return before
+
+
+def restore_payloads(stage: Usd.Stage, members: Iterable[str], loaded: Iterable[Sdf.Path]):
+    """Put back the payloads of the members returned by switch_payloads, the unloads are processed first"""
+    stage.LoadAndUnload(set(loaded), {Sdf.Path(_) for _ in members}, Usd.LoadWithoutDescendants)
+
+
+def merge_members(members: Iterable[str], paths: Iterable[str]) -> Tuple[List[str], List[str]]:
+    """Append the paths that are not members yet, returns the new member list and the added paths"""
+    members = list(members)
+    known = set(members)
+    added = []
+    for path in paths:
+        if path not in known:
+            known.add(path)
+            added.append(path)
+    return members + added, added
+
+
+def collect_members(stage: Usd.Stage, paths: Iterable[str], type_name: str = "") -> List[str]:
+    """
+    The given prims, or with a type name the prims of that type (schema subtypes included)
+    at or under them, in traversal order
+    """
+    if not type_name:
+        return [str(path) for path in paths]
+
+    schema_type = Usd.SchemaRegistry.GetTypeFromName(type_name)
+
+    def matches(prim: Usd.Prim) -> bool:
+        if schema_type.isUnknown:
+            return prim.GetTypeName() == type_name
+        return prim.IsA(schema_type)
+
+    result = []
+    for path in paths:
+        prim = stage.GetPrimAtPath(str(path))
+        if prim:
+            result.extend(str(_.GetPath()) for _ in Usd.PrimRange(prim) if matches(_))
+    return result
+
+
+def variant_names(members: Iterable[str]) -> List[str]:
+    """Unique, valid variant names made from the member prim names"""
+    names = []
+    used = set()
+    for path in members:
+        base = Tf.MakeValidIdentifier(Sdf.Path(path).name)
+        name = base
+        i = 1
+        while name in used:
+            name = f"{base}_{i}"
+            i += 1
+        used.add(name)
+        names.append(name)
+    return names
+
+
+def check_bake_target(stage: Usd.Stage, sets: Dict[str, List[str]], target_path):
+    """Raises ValueError when the sets can't be baked on the target prim"""
+    target_path = Sdf.Path(target_path)
+    if target_path == Sdf.Path.absoluteRootPath or not stage.GetPrimAtPath(target_path):
+        raise ValueError(f"invalid target prim {target_path}")
+
+    all_members = [m for members in sets.values() for m in members]
+    outside = [m for m in all_members if Sdf.Path(m) == target_path or not Sdf.Path(m).HasPrefix(target_path)]
+    if outside:
+        raise ValueError(f"members are not descendants of {target_path}: {', '.join(outside)}")
+
+
+def bake_variant_sets(stage: Usd.Stage, sets: Dict[str, List[str]], target_path, clear_local_visibility=True):
+    """
+    Author every set as a native UsdVariantSet on the target prim, one variant per
+    member with the visibility of all the members authored inside the variant.
+    The selection of each variant set is the member visible now.
+
+    The members must be descendants of the target prim. Local visibility opinions
+    on the members are stronger than variant opinions, they are removed from the
+    edit target unless clear_local_visibility is False.
+
+    Returns the removed local opinions, for restore_visibility.
+    """
+    target_path = Sdf.Path(target_path)
+    check_bake_target(stage, sets, target_path)
+    prim = stage.GetPrimAtPath(target_path)
+    all_members = [m for members in sets.values() for m in members]
+
+    selections = {}
+    for set_name, members in sets.items():
+        names = variant_names(members)
+        selections[set_name] = names[0] if names else ""
+        for name, member in zip(names, members):
+            member_prim = stage.GetPrimAtPath(member)
+            if member_prim and UsdGeom.Imageable(member_prim).ComputeVisibility() != UsdGeom.Tokens.invisible:
+                selections[set_name] = name
+                break
+
+    removed = {}
+    if clear_local_visibility:
+        removed = clear_visibility(stage.GetEditTarget(), all_members)
+
+    variant_sets = prim.GetVariantSets()
+    for set_name, members in sets.items():
+        variant_set = variant_sets.AddVariantSet(set_name)
+        for name, member in zip(variant_names(members), members):
+            variant_set.AddVariant(name)
+            variant_set.SetVariantSelection(name)
+            author_visibility(variant_set.GetVariantEditTarget(), activation(members, member))
+        if selections[set_name]:
+            variant_set.SetVariantSelection(selections[set_name])
+    return removed
+
+
+def combination_count(sizes: Sequence[int]) -> int:
+    count = 1
+    for size in sizes:
+        count *= size
+    return count
+
+
+def gray_combination(index: int, sizes: Sequence[int]) -> Tuple[int, ...]:
+    """
+    The combination at `index` in reflected mixed-radix Gray code order: the
+    last position changes fastest, and two consecutive combinations differ in
+    exactly one position.
+    """
+    digits = [0] * len(sizes)
+    for i in range(len(sizes) - 1, -1, -1):
+        index, digit = divmod(index, sizes[i])
+        # The digit runs backward on every other pass
+        digits[i] = sizes[i] - 1 - digit if index % 2 else digit
+    return tuple(digits)
+
+
+def iter_combinations(sets: Dict[str, List[str]], start: int = 0) -> Iterator[Tuple[int, str, Dict[str, str]]]:
+    """
+    Streams the cartesian product of the members of several sets, in Gray code
+    order so only one set switches between two consecutive combinations.
+
+    Yields (index, name, switches): switches maps the set names to the member
+    to activate, it only holds the sets that changed since the previous
+    combination (every set for the first one). The name is made of the set
+    and member names, e.g. "Paint-Red__Wheels-Sport", or is the member name
+    when there is a single set. Member names are those of variant_names, unique
+    within a set. `start` resumes at an index.
+    """
+    names = list(sets)
+    members = [sets[_] for _ in names]
+    # Members with the same prim name in different places still get their own file
+    member_names = [variant_names(_) for _ in members]
+    sizes = [len(_) for _ in members]
+    previous = None
+    for index in range(start, combination_count(sizes)):
+        combination = gray_combination(index, sizes)
+        switches = {
+            names[i]: members[i][digit]
+            for i, digit in enumerate(combination)
+            if previous is None or previous[i] != digit
+        }
+        if len(names) == 1:
+            name = member_names[0][combination[0]]
+        else:
+            name = "__".join(f"{names[i]}-{member_names[i][digit]}" for i, digit in enumerate(combination))
+        previous = combination
+        yield index, name, switches
+
+
+class VisibilityCache:
+    """
+    Computed visibility of prims (the UsdGeom.Imageable.ComputeVisibility rules:
+    a prim is invisible when it or any ancestor is authored invisible), keyed by
+    prim path. Ancestors are memoized so a batch of siblings resolves every
+    shared ancestor once. Entries are invalidated from ObjectsChanged, one pass per notice.
+    """
+
+    def __init__(self, stage: Usd.Stage):
+        self.stage = stage
+        self._visible: Dict[Sdf.Path, bool] = {}
+        self._listener = Tf.Notice.Register(Usd.Notice.ObjectsChanged, self._on_objects_changed, stage)
+
+    def destroy(self):
+        if self._listener:
+            self._listener.Revoke()
+            self._listener = None
+        self._visible = {}
+
+    def get(self, path) -> bool:
+        path = Sdf.Path(path)
+        visible = self._visible.get(path)
+        if visible is not None:
+            return visible
+
+        # Walk up to the closest known ancestor, then resolve back down
+        pending = []
+        current = path
+        inherited = True
+        while current != Sdf.Path.absoluteRootPath:
+            known = self._visible.get(current)
+            if known is not None:
+                inherited = known
+                break
+            pending.append(current)
+            current = current.GetParentPath()
+
+        for current in reversed(pending):
+            if inherited:
+                prim = self.stage.GetPrimAtPath(current)
+                if not prim:
+                    # Missing prims are not shown, and neither are their descendants
+                    inherited = False
+                else:
+                    attr = prim.GetAttribute(UsdGeom.Tokens.visibility)
+                    inherited = not attr or attr.Get() != UsdGeom.Tokens.invisible
+            self._visible[current] = inherited
+        return self._visible[path]
+
+    def get_many(self, paths: Iterable[str]) -> Dict[str, bool]:
+        """Resolve many prims in one pass"""
+        return {path: self.get(path) for path in paths}
+
+    def invalidate(self, path=None):
+        """Forget a prim and its descendants, or everything"""
+        self.invalidate_many([Sdf.Path.absoluteRootPath if path is None else path])
+
+    def invalidate_many(self, paths: Iterable):
+        """Forget many prims and their descendants, in one pass over the cache whatever the number of paths"""
+        changed = {Sdf.Path(_) for _ in paths}
+        if not changed:
+            return
+        if Sdf.Path.absoluteRootPath in changed:
+            self._visible = {}
+            return
+        self._visible = {
+            path: visible for path, visible in self._visible.items() if changed.isdisjoint(path.GetPrefixes())
+        }
+
+    def _on_objects_changed(self, notice, stage):
+        if not self._visible:
+            return
+        paths = [_.GetPrimPath() for _ in notice.GetResyncedPaths()]
+        paths += [
+            _.GetPrimPath() for _ in notice.GetChangedInfoOnlyPaths()
+            if _.IsPropertyPath() and _.name == UsdGeom.Tokens.visibility
+        ]
+        self.invalidate_many(paths)
+
+
+class SwitchPlanner:
+    """
+    Plans the visibility writes of a switch: only the members whose visibility
+    differs between the current state and the target variant are written.
+
+    The member the planner switched on last is remembered per set, and the
+    plan between two members is cached (up to `max_plans`, least recently used
+    first out), so switching back and forth between known variants reads
+    nothing from the stage. Visibility edits done by anything else than
+    `applying()` forget what the planner knows about the sets.
+    """
+
+    def __init__(self, stage: Usd.Stage, max_plans: int = 256):
+        self.stage = stage
+        self.max_plans = max_plans
+        self._plans = OrderedDict()
+        self._active = {}
+        self._member_keys: Dict[Sdf.Path, str] = {}
+        self._applying = False
+        self._listener = Tf.Notice.Register(Usd.Notice.ObjectsChanged, self._on_objects_changed, stage)
+
+    def destroy(self):
+        if self._listener:
+            self._listener.Revoke()
+            self._listener = None
+        self.invalidate()
+
+    def invalidate(self, key: str = None):
+        """Forget the state of one set, or of every set"""
+        if key is None:
+            self._active = {}
+        else:
+            self._active.pop(key, None)
+
+    def read_state(self, members: Iterable[str]) -> Dict[str, bool]:
+        """Visibility authored on each member, None when the member doesn't exist"""
+        state = {}
+        for path in members:
+            prim = self.stage.GetPrimAtPath(path)
+            attr = prim.GetAttribute(UsdGeom.Tokens.visibility) if prim else None
+            state[path] = attr.Get() != UsdGeom.Tokens.invisible if attr else None
+        return state
+
+    def plan(self, key: str, members: Iterable[str], target: str) -> Dict[str, bool]:
+        """The visibility writes that switch the set `key` to the member `target`"""
+        members = tuple(members)
+        active = self._active.get(key)
+        if active is not None:
+            cached = self._plans.get((key, active, target))
+            if cached and cached[0] == members:
+                self._plans.move_to_end((key, active, target))
+                return cached[1]
+
+        current = self.read_state(members)
+        wanted = activation(members, target)
+        delta = {path: visible for path, visible in wanted.items() if current[path] != visible}
+
+        on = [path for path, visible in current.items() if visible]
+        if len(on) == 1:
+            # The set is in a known variant, the plan is valid whenever it is again
+            self._plans[(key, on[0], target)] = (members, delta)
+            if len(self._plans) > self.max_plans:
+                self._plans.popitem(last=False)
+        return delta
+
+    def commit(self, key: str, members: Iterable[str], target: str):
+        """Record that the set `key` is now switched to `target`"""
+        self._active[key] = target
+        for path in members:
+            self._member_keys[Sdf.Path(path)] = key
+
+    @contextmanager
+    def applying(self):
+        """Edits done in this context are the planner's own, they don't invalidate it"""
+        self._applying = True
+        try:
+            yield
+        finally:
+            self._applying = False
+
+    def _on_objects_changed(self, notice, stage):
+        if self._applying or not self._active:
+            return
+        if notice.GetResyncedPaths():
+            self.invalidate()
+            return
+        for path in notice.GetChangedInfoOnlyPaths():
+            if path.name == UsdGeom.Tokens.visibility:
+                key = self._member_keys.get(path.GetPrimPath())
+                if key is not None:
+                    self.invalidate(key)
+
+
+class SwitchLayer:
+    """
+    An anonymous sublayer of the session layer that receives the switch edits, so
+    that switching never dirties the layers of the asset. revert() drops every
+    switch at once, commit_switch_layer writes the result to a layer of the asset.
+    """
+
+    def __init__(self, stage: Usd.Stage):
+        self.stage = stage
+        self.layer = Sdf.Layer.CreateAnonymous("variant_switcher")
+        # Strongest sublayer of the session layer, above whatever else the session holds
+        stage.GetSessionLayer().subLayerPaths.insert(0, self.layer.identifier)
+        self.edit_target = Usd.EditTarget(self.layer)
+
+    def destroy(self):
+        """Remove the layer from the stage, its edits are dropped"""
+        if self.layer is None:
+            return
+        sub_layers = self.stage.GetSessionLayer().subLayerPaths
+        if self.layer.identifier in sub_layers:
+            sub_layers.remove(self.layer.identifier)
+        self.layer = None
+        self.edit_target = None
+
+    def has_edits(self) -> bool:
+        return bool(self.layer.rootPrims)
+
+    def visibility(self) -> Dict[str, bool]:
+        """The visibility authored on the layer, in the author_visibility format"""
+        visibility = {}
+
+        def collect(path):
+            if path.IsPropertyPath() and path.name == UsdGeom.Tokens.visibility:
+                attr_spec = self.layer.GetAttributeAtPath(path)
+                if attr_spec.HasDefaultValue():
+                    visibility[str(path.GetPrimPath())] = attr_spec.default != UsdGeom.Tokens.invisible
+
+        self.layer.Traverse(Sdf.Path.absoluteRootPath, collect)
+        return visibility
+
+    def revert(self):
+        self.layer.Clear()
+
+
+def commit_switch_layer(switch_layer: SwitchLayer, edit_target: Usd.EditTarget):
+    """
+    Author the visibility of the switch layer on edit_target and clear the switch layer.
+    Returns the previous opinions of edit_target and a copy of the switch layer, for undo.
+    """
+    snapshot = Sdf.Layer.CreateAnonymous()
+    snapshot.TransferContent(switch_layer.layer)
+    prev = author_visibility(edit_target, switch_layer.visibility())
+    switch_layer.revert()
+    return prev, snapshot
+
+
+def payload_layers(prim: Usd.Prim) -> List[str]:
+    """Identifiers of the layers the payloads of a prim and of its composed descendants point to"""
+    identifiers = []
+    # The prims with a payload are usually unloaded, the default predicate would skip them
+    for descendant in Usd.PrimRange(prim, Usd.PrimAllPrimsPredicate):
+        for spec in descendant.GetPrimStack():
+            for payload in spec.payloadList.GetAppliedItems():
+                if payload.assetPath:
+                    identifiers.append(spec.layer.ComputeAbsolutePath(payload.assetPath))
+    return identifiers
+
+
+def open_layers(identifiers: Iterable[str]) -> List[Sdf.Layer]:
+    """Open layers and every layer they compose (sublayers, references, payloads), safe in a worker thread"""
+    layers = []
+    pending = list(identifiers)
+    seen = set()
+    while pending:
+        identifier = pending.pop()
+        if identifier in seen:
+            continue
+        seen.add(identifier)
+        try:
+            layer = Sdf.Layer.FindOrOpen(identifier)
+        except Tf.ErrorException:
+            layer = None
+        if layer:
+            layers.append(layer)
+            pending.extend(layer.ComputeAbsolutePath(_) for _ in layer.GetCompositionAssetDependencies())
+    return layers
+
+
+class PayloadPrefetcher:
+    """
+    Opens the payload layers of the members a batch will activate next in a worker
+    thread, while the current one renders. Switching to a member then only composes
+    its payloads, their files are read already.
+
+    The opened layers are held per member, least recently requested first out. The
+    active member of each set and the members prefetched but not activated yet are
+    never dropped, the others are once more than `max_members` are held, or one at a
+    time while `memory_fn()` (bytes) exceeds `memory_limit`. Only the active member
+    of each set has its payloads loaded on the stage.
+    """
+
+    def __init__(self, stage: Usd.Stage, max_members: int = 8, memory_limit: int = 0, memory_fn=None):
+        self.stage = stage
+        self.max_members = max_members
+        self.memory_limit = memory_limit
+        self._memory_fn = memory_fn
+        # Member path -> future of its opened layers
+        self._layers: Dict[Sdf.Path, Future] = OrderedDict()
+        self._pending = set()
+        self._active: Dict[str, Sdf.Path] = {}
+        self._queue = deque()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VariantPrefetch")
+
+    def destroy(self):
+        self.clear()
+        self._executor.shutdown(wait=False)
+
+    def activate(self, key: str, members: Iterable[str], target: str):
+        """
+        Make `target` the active member of the set `key`: its payloads are loaded and those
+        of the other members unloaded, in one LoadAndUnload
+        """
+        target = Sdf.Path(target)
+        switch_payloads(self.stage, members, target)
+        self._active[key] = target
+        self._pending.discard(target)
+        if target in self._layers:
+            self._layers.move_to_end(target)
+
+    def request(self, paths: Iterable[str]):
+        """Queue members to prefetch, in the order they will be needed"""
+        for path in (Sdf.Path(_) for _ in paths):
+            if path not in self._layers and path not in self._queue:
+                self._queue.append(path)
+
+    def step(self) -> bool:
+        """
+        Hand the next queued member to the worker, it never waits for a file. Returns False
+        when there was nothing to prefetch or no room.
+        """
+        while self._queue and self._queue[0] in self._layers:
+            self._queue.popleft()
+        if not self._queue:
+            return False
+
+        if self._over_memory():
+            self._evict(1)
+            return False
+        if len(self._layers) >= self.max_members and not self._evict(len(self._layers) - self.max_members + 1):
+            return False
+
+        path = self._queue.popleft()
+        prim = self.stage.GetPrimAtPath(path)
+        # The payload arcs are read here, the worker only touches layers
+        self._layers[path] = self._executor.submit(open_layers, payload_layers(prim) if prim else [])
+        self._pending.add(path)
+        return True
+
+    def is_ready(self, path) -> bool:
+        """True once the payload layers of a requested member are open"""
+        future = self._layers.get(Sdf.Path(path))
+        return future is not None and future.done()
+
+    def clear(self):
+        """Forget the queue and release the opened layers, the stage is left as it is"""
+        self._queue.clear()
+        for future in self._layers.values():
+            future.cancel()
+        self._layers.clear()
+        self._pending.clear()
+        self._active = {}
+
+    def _over_memory(self) -> bool:
+        if not self.memory_limit or not self._memory_fn:
+            return False
+        memory = self._memory_fn()
+        return memory is not None and memory > self.memory_limit
+
+    def _evict(self, count: int) -> bool:
+        """Release the layers of up to `count` least recently requested members, returns False when none could be"""
+        if count <= 0:
+            return True
+        keep = self._pending | set(self._active.values())
+        released = [_ for _ in self._layers if _ not in keep][:count]
+        if not released:
+            return False
+        for path in released:
+            # A running open completes, its layers go once nothing holds them
+            self._layers.pop(path).cancel()
+        return True
+
+
+class VariantEngine:
+    """
+    Variant sets stored under a cache root prim of a stage.
+
+    Every set is a child prim of the cache root, its members are prim paths
+    stored in order on the set prim. Activating a member makes it visible and
+    hides the other members of the set. Edits go to the stage edit target.
+    """
+
+    def __init__(self, stage: Usd.Stage, cache_root: str = DEFAULT_CACHE_ROOT, planner: SwitchPlanner = None):
+        self.stage = stage
+        self.cache_root = Sdf.Path(cache_root)
+        self._planner = planner
+
+    @property
+    def planner(self) -> SwitchPlanner:
+        # Made on the first activation, editing the sets doesn't need one
+        if self._planner is None:
+            self._planner = SwitchPlanner(self.stage)
+        return self._planner
+
+    def set_path(self, name: str) -> Sdf.Path:
+        return self.cache_root.AppendChild(name)
+
+    def list_sets(self) -> List[str]:
+        root = self.stage.GetPrimAtPath(self.cache_root)
+        return [_.GetName() for _ in root.GetAllChildren()] if root else []
+
+    def has_set(self, name: str) -> bool:
+        return bool(self.stage.GetPrimAtPath(self.set_path(name)))
+
+    def members(self, name: str) -> List[str]:
+        prim = self.stage.GetPrimAtPath(self.set_path(name))
+        return read_members(prim) if prim else []
+
+    def load(self) -> Dict[str, List[str]]:
+        """All the sets and their members, legacy sets are migrated first"""
+        self.migrate_legacy()
+        return {name: self.members(name) for name in self.list_sets()}
+
+    def create_set(self, name: str, members: Iterable[str] = ()):
+        if not self.stage.GetPrimAtPath(self.cache_root):
+            self.stage.DefinePrim(self.cache_root, "Scope")
+        self.stage.DefinePrim(self.set_path(name), "Scope")
+        members = list(members)
+        if members:
+            self.set_members(name, members)
+
+    def delete_sets(self, names: Iterable[str], remove_empty_root: bool = False):
+        """Remove sets, with remove_empty_root the cache root goes as well once it has no set left"""
+        with Sdf.ChangeBlock():
+            for name in names:
+                self.stage.RemovePrim(self.set_path(name))
+        if remove_empty_root and not self.list_sets():
+            self.stage.RemovePrim(self.cache_root)
+
+    def is_free_name(self, name: str) -> bool:
+        """True for a valid set name that no child of the cache root uses, looks up a single path"""
+        return Sdf.Path.IsValidIdentifier(name) and not self.stage.GetPrimAtPath(self.set_path(name))
+
+    def next_free_name(self, prefix: str = "Variant_") -> str:
+        """The first f"{prefix}{i}" (i >= 1) no set uses, only the children of the cache root are read"""
+        used = set(self.list_sets())
+        i = 1
+        while f"{prefix}{i}" in used:
+            i += 1
+        return f"{prefix}{i}"
+
+    def rename_set(self, name: str, new_name: str):
+        edit = Sdf.BatchNamespaceEdit()
+        edit.Add(self.set_path(name), self.set_path(new_name))
+        layer = self.stage.GetEditTarget().GetLayer()
+        if not layer.Apply(edit):
+            raise ValueError(f"cannot rename variant set {name} to {new_name}")
+
+    def set_members(self, name: str, members: Iterable[str]):
+        author_members(self.stage.GetEditTarget(), self.set_path(name), list(members))
+
+    def add_members(self, name: str, paths: Iterable[str]) -> List[str]:
+        """Add the paths that are not members yet, returns them"""
+        members, added = merge_members(self.members(name), paths)
+        if added:
+            self.set_members(name, members)
+        return added
+
+    def remove_members(self, name: str, paths: Iterable[str]):
+        removed = set(paths)
+        self.set_members(name, [_ for _ in self.members(name) if _ not in removed])
+
+    def reorder(self, name: str, source_index: int, target_index: int):
+        move_member(self.stage, self.stage.GetEditTarget(), self.set_path(name), source_index, target_index)
+
+    def activate(self, name: str, member: Union[str, int], unload: bool = False) -> Dict[str, bool]:
+        """
+        Make one member visible and hide the others, by path or by position.
+        Only the members that change are written, they are returned.
+        With unload the payloads of the other members are unloaded as well.
+        """
+        members = self.members(name)
+        if isinstance(member, int):
+            member = members[member]
+        elif member not in members:
+            raise KeyError(f"{member} is not a member of variant set {name}")
+        key = str(self.set_path(name))
+        visibility = self.planner.plan(key, members, member)
+        with self.planner.applying():
+            if visibility:
+                author_visibility(self.stage.GetEditTarget(), visibility)
+            if unload:
+                switch_payloads(self.stage, members, member)
+        self.planner.commit(key, members, member)
+        return visibility
+
+    def migrate_legacy(self):
+        """Convert the sets that store one Scope prim per member into the member list attribute"""
+        root = self.stage.GetPrimAtPath(self.cache_root)
+        if not root:
+            return
+        for prim in root.GetAllChildren():
+            if is_legacy(prim):
+                members, legacy_prims = decode_legacy(prim)
+                members = read_members(prim) + members
+                with Sdf.ChangeBlock():
+                    for path in legacy_prims:
+                        self.stage.RemovePrim(path)
+                author_members(self.stage.GetEditTarget(), prim.GetPath(), members)
+
+    def bake(self, target_path, names: Iterable[str] = None, clear_local_visibility=True):
+        """Author the sets (all of them by default) as native UsdVariantSets on the target prim"""
+        names = self.list_sets() if names is None else list(names)
+        sets = {name: self.members(name) for name in names}
+        return bake_variant_sets(self.stage, sets, target_path, clear_local_visibility)
+
+    def export(self, file_path: str = None) -> Dict[str, List[str]]:
+        """The sets and their members, also written as json when a file path is given"""
+        data = {name: self.members(name) for name in self.list_sets()}
+        if file_path:
+            with open(file_path, "w") as f:
+                json.dump({"cache_root": str(self.cache_root), "sets": data}, f, indent=4)
+        return data
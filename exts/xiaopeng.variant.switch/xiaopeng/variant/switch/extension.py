@@ -4,8 +4,10 @@ from .window import VariantSwitchWindow
 from functools import partial
 import asyncio
 import omni.ext
+import omni.kit.commands
 import omni.kit.ui
 import omni.ui as ui
+from . import commands
 
 
 # Any class derived from `omni.ext.IExt` in top level module (defined in `python.modules` of `extension.toml`) will be
@@ -18,6 +20,8 @@ class XiaopengVariantSwitchExtension(omni.ext.IExt):
     MENU_PATH = f"Window/XPeng/{WINDOW_NAME}"
 
     def on_startup(self):
+        omni.kit.commands.register_all_commands_in_module(commands)
+
         # The ability to show up the window if the system requires it. We use it
         # in QuickLayout.
         ui.Workspace.set_show_window_fn(XiaopengVariantSwitchExtension.WINDOW_NAME, partial(self.show_window, None))
@@ -41,6 +45,8 @@ class XiaopengVariantSwitchExtension(omni.ext.IExt):
         # Deregister the function that shows the window from omni.ui
         ui.Workspace.set_show_window_fn(XiaopengVariantSwitchExtension.WINDOW_NAME, None)
 
+        omni.kit.commands.unregister_module_commands(commands)
+
     def _set_menu(self, value):
         """Set the menu to create this window on and off"""
         editor_menu = omni.kit.ui.get_editor_menu()
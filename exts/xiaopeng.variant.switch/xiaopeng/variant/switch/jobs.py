@@ -0,0 +1,167 @@
+import asyncio
+import carb
+from collections import deque
+from enum import Enum
+from typing import Awaitable, Callable, List, Optional
+
+
+class JobState(Enum):
+    QUEUED = "queued"
+    RUNNING = "running"
+    PAUSED = "paused"
+    DONE = "done"
+    CANCELLED = "cancelled"
+    FAILED = "failed"
+
+
+class Job:
+    """
+    A unit of work run by the JobRunner.
+
+    run_fn(job) is a coroutine. It reports its progress with set_progress and
+    awaits checkpoint() between steps, that is where the job pauses and where a
+    cancel takes effect.
+    """
+
+    def __init__(self, name: str, run_fn: Callable[["Job"], Awaitable]):
+        self.name = name
+        self.state = JobState.QUEUED
+        self.progress = 0.0
+        self.message = ""
+        self.error: Optional[Exception] = None
+        self._run_fn = run_fn
+        self._runner = None
+        self._cancelled = False
+        self._resumed = None
+
+    def set_progress(self, progress: float, message: str = ""):
+        self.progress = progress
+        self.message = message
+        self._notify()
+
+    async def checkpoint(self) -> bool:
+        """Wait while the job is paused, returns True when it was. Raises CancelledError once cancelled."""
+        paused = False
+        while self.state == JobState.PAUSED and not self._cancelled:
+            paused = True
+            await self._resumed.wait()
+        if self._cancelled:
+            raise asyncio.CancelledError()
+        return paused
+
+    def _set_state(self, state: JobState):
+        self.state = state
+        if self._resumed is None:
+            self._resumed = asyncio.Event()
+        if state == JobState.PAUSED:
+            self._resumed.clear()
+        else:
+            self._resumed.set()
+        self._notify()
+
+    def _notify(self):
+        if self._runner:
+            self._runner._notify(self)
+
+
+class JobRunner:
+    """
+    Runs jobs one after the other on the asyncio loop of Kit, a task only exists
+    while there are jobs. Listeners are called with the job on every change of
+    its state or progress.
+    """
+
+    def __init__(self):
+        self._queue = deque()
+        self._current: Optional[Job] = None
+        self._task = None
+        self._listeners: List[Callable[[Job], None]] = []
+
+    def destroy(self):
+        self.cancel_all()
+        self._listeners = []
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    @property
+    def current(self) -> Optional[Job]:
+        return self._current
+
+    @property
+    def queued(self) -> List[Job]:
+        return list(self._queue)
+
+    @property
+    def busy(self) -> bool:
+        return self._current is not None or bool(self._queue)
+
+    def add_listener(self, fn: Callable[[Job], None]):
+        self._listeners.append(fn)
+
+    def remove_listener(self, fn: Callable[[Job], None]):
+        if fn in self._listeners:
+            self._listeners.remove(fn)
+
+    def submit(self, job: Job) -> Job:
+        job._runner = self
+        self._queue.append(job)
+        job._set_state(JobState.QUEUED)
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run_async())
+        return job
+
+    def pause(self, job: Job = None):
+        job = job or self._current
+        if job and job.state == JobState.RUNNING:
+            job._set_state(JobState.PAUSED)
+
+    def resume(self, job: Job = None):
+        job = job or self._current
+        if job and job.state == JobState.PAUSED:
+            job._set_state(JobState.RUNNING)
+
+    def cancel(self, job: Job = None):
+        """Cancel a job, the running one by default. A queued job is removed right away."""
+        job = job or self._current
+        if job is None:
+            return
+        if job in self._queue:
+            self._queue.remove(job)
+            job._set_state(JobState.CANCELLED)
+        elif job is self._current:
+            job._cancelled = True
+            # Wake it up if it is paused, it stops at its next checkpoint
+            job._resumed.set()
+
+    def cancel_all(self):
+        for job in list(self._queue):
+            self.cancel(job)
+        self.cancel()
+
+    def _notify(self, job: Job):
+        for fn in list(self._listeners):
+            fn(job)
+
+    async def _run_async(self):
+        try:
+            while self._queue:
+                job = self._queue.popleft()
+                self._current = job
+                job._set_state(JobState.RUNNING)
+                try:
+                    await job._run_fn(job)
+                    job._set_state(JobState.DONE)
+                except asyncio.CancelledError:
+                    job._set_state(JobState.CANCELLED)
+                    if not job._cancelled:
+                        # The runner itself is cancelled
+                        raise
+                except Exception as e:
+                    job.error = e
+                    carb.log_error(f"[xiaopeng.variant.switch] job {job.name} failed: {e}")
+                    job._set_state(JobState.FAILED)
+                finally:
+                    self._current = None
+        finally:
+            self._task = None
@@ -0,0 +1,173 @@
+"""
+Manifest of the images written by a batch, so a batch run again only renders what changed.
+
+Every image is recorded with a hash of the state it was rendered from: the
+active member of every set, the visibility the members inherit, the files
+of the stage and of the members, the camera and the render settings.
+"""
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Tuple
+from pxr import Ar, Usd, Sdf, UsdGeom
+from .engine import iter_combinations
+
+MANIFEST_NAME = "variant_switcher_manifest.json"
+MANIFEST_VERSION = 1
+
+
+class BatchStep(NamedTuple):
+    index: int
+    name: str
+    # set name -> active member, for every set
+    combination: Dict[str, str]
+    digest: str
+    # The image on disk was rendered from the same state
+    done: bool
+
+
+def _digest(value) -> str:
+    return hashlib.sha1(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def layer_state(stage: Usd.Stage, members: Iterable[str] = ()) -> List[list]:
+    """
+    Identifier, modification time and size of the files an image depends on, whatever payloads
+    are loaded: the layer stack of the stage, the layers the members are authored in and the
+    files their payloads and references point to. The files those files pull in further down
+    are not followed, nor are unsaved edits seen: save before an incremental batch. Anonymous
+    layers only hold session edits such as the switch layer, whose visibility is hashed per
+    variant.
+    """
+    identifiers = set()
+    for layer in stage.GetLayerStack(includeSessionLayers=False):
+        identifiers.add(layer.identifier)
+    for path in members:
+        prim = stage.GetPrimAtPath(str(path))
+        if not prim:
+            continue
+        for spec in prim.GetPrimStack():
+            identifiers.add(spec.layer.identifier)
+            arcs = list(spec.payloadList.GetAppliedItems()) + list(spec.referenceList.GetAppliedItems())
+            identifiers.update(spec.layer.ComputeAbsolutePath(_.assetPath) for _ in arcs if _.assetPath)
+
+    resolver = Ar.GetResolver()
+    state = []
+    for identifier in identifiers:
+        if Sdf.Layer.IsAnonymousLayerIdentifier(identifier):
+            continue
+        try:
+            stat = os.stat(str(resolver.Resolve(identifier)))
+            state.append([identifier, stat.st_mtime, stat.st_size])
+        except OSError:
+            state.append([identifier])
+    return sorted(state)
+
+
+def camera_state(stage: Usd.Stage, camera_path) -> dict:
+    """World transform and authored attributes of the camera"""
+    prim = stage.GetPrimAtPath(str(camera_path)) if camera_path else None
+    if not prim:
+        return {"path": str(camera_path)}
+    matrix = UsdGeom.Xformable(prim).ComputeLocalToWorldTransform(Usd.TimeCode.Default())
+    return {
+        "path": str(camera_path),
+        "transform": [list(row) for row in matrix],
+        "attributes": {attr.GetName(): attr.Get() for attr in prim.GetAttributes() if attr.HasAuthoredValue()},
+    }
+
+
+def batch_hash(stage: Usd.Stage, sets: Dict[str, List[str]], camera_path=None, render_settings: dict = None) -> str:
+    """Hash of everything a batch image depends on, apart from the active members"""
+    inherited = {}
+    for members in sets.values():
+        for path in members:
+            # Visibility the member inherits from its closest imageable ancestor
+            parent = stage.GetPrimAtPath(Sdf.Path(path).GetParentPath())
+            while parent and not parent.IsPseudoRoot() and not parent.IsA(UsdGeom.Imageable):
+                parent = parent.GetParent()
+            if parent and parent.IsA(UsdGeom.Imageable):
+                inherited[path] = UsdGeom.Imageable(parent).ComputeVisibility()
+    return _digest({
+        "version": MANIFEST_VERSION,
+        "sets": sets,
+        "inherited": inherited,
+        "layers": layer_state(stage, [path for members in sets.values() for path in members]),
+        "camera": camera_state(stage, camera_path),
+        "render_settings": render_settings or {},
+    })
+
+
+def variant_hash(base_hash: str, combination: Dict[str, str]) -> str:
+    return _digest([base_hash, combination])
+
+
+class BatchManifest:
+    """
+    The images of a folder and the hash they were rendered from. Images are
+    recorded once written and the file is saved every `flush_seconds`, an
+    interrupted batch loses at most the images of that interval.
+    """
+
+    def __init__(self, folder: str, flush_seconds: float = 2.0):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.folder = folder
+        self.flush_seconds = flush_seconds
+        self._images: Dict[str, str] = {}
+        self._expected: Dict[str, str] = {}
+        self._dirty = False
+        self._flushed = time.monotonic()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            data = {}
+        if data.get("version") == MANIFEST_VERSION:
+            self._images = dict(data.get("images", {}))
+
+    def is_current(self, file_name: str, digest: str) -> bool:
+        return self._images.get(file_name) == digest and os.path.exists(os.path.join(self.folder, file_name))
+
+    def expect(self, path: str, digest: str):
+        """An image is being written from the state of `digest`, it is recorded once written"""
+        self._expected[os.path.normpath(path)] = digest
+        # Until then the previous image of that name is not current anymore
+        if self._images.pop(os.path.basename(path), None) is not None:
+            self._dirty = True
+
+    def record(self, written_paths: Iterable[str]) -> List[Tuple[str, str]]:
+        """Record written images, returns their (path, hash)"""
+        recorded = []
+        for path in written_paths:
+            digest = self._expected.pop(os.path.normpath(path), None)
+            if digest is not None:
+                self._images[os.path.basename(path)] = digest
+                self._dirty = True
+                recorded.append((path, digest))
+        if self._dirty and time.monotonic() - self._flushed >= self.flush_seconds:
+            self.flush()
+        return recorded
+
+    def flush(self):
+        if not self._dirty:
+            return
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"version": MANIFEST_VERSION, "images": self._images}, f, indent=4, sort_keys=True)
+        # The manifest on disk is always complete, even when the batch is interrupted
+        os.replace(tmp_path, self.path)
+        self._dirty = False
+        self._flushed = time.monotonic()
+
+
+def plan_steps(sets: Dict[str, List[str]], start: int, base_hash: str, manifest: BatchManifest) -> Iterator[BatchStep]:
+    """The combinations of iter_combinations, with the hash of their state and whether their image is current"""
+    combination = {}
+    for index, name, switches in iter_combinations(sets, start):
+        combination.update(switches)
+        digest = variant_hash(base_hash, combination)
+        yield BatchStep(index, name, dict(combination), digest, manifest.is_current(name + ".png", digest))
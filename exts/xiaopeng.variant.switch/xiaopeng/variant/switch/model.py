@@ -1,13 +1,66 @@
 import omni.ext
 import omni.ui as ui
 import omni.kit.commands
+import omni.kit.undo
 import omni.usd
+import carb
 from typing import Union
 from pxr import Usd, Sdf, UsdGeom, UsdShade
 import os
+from contextlib import ExitStack
 from .style import STOP_BUTTON, BUTTON, STRING_FIELD, TOOL_BUTTON
 from omni.kit.widget.stage import StageWidget
 from omni.kit.widget.stage import StageIcons
+from .engine import activation, author_visibility, switch_payloads
+from .profiling import profile, resident_memory
+
+MB = 1024 * 1024
+
+def switch_variant(planner, key, members, target, switch_layer=None, unload=False):
+    """
+    Switch the set `key` to the member `target`, as one undoable command.
+    With a switch layer the edits go to that layer instead, outside of the undo stack:
+    they are reverted or committed as a whole.
+    With unload the payloads of the other members are unloaded, only the active one stays in memory.
+    """
+    if planner:
+        # Only the members whose visibility changes are written
+        visibility = planner.plan(key, members, target)
+    else:
+        visibility = activation(members, target)
+
+    if visibility or unload:
+        with ExitStack() as stack:
+            if planner:
+                stack.enter_context(planner.applying())
+            if unload and not switch_layer:
+                # Visibility and payloads are undone together
+                stack.enter_context(omni.kit.undo.group())
+            if visibility:
+                if switch_layer:
+                    author_visibility(switch_layer.edit_target, visibility)
+                else:
+                    # One command for the whole switch: a single Sdf.ChangeBlock and a single undo entry
+                    omni.kit.commands.execute("SetVariantVisibility", visibility=visibility)
+            if unload:
+                _switch_payloads(key, members, target, switch_layer)
+    if planner:
+        planner.commit(key, members, target)
+
+
+def _switch_payloads(key, members, target, switch_layer):
+    before = resident_memory()
+    if switch_layer:
+        switch_payloads(switch_layer.stage, members, target)
+    else:
+        omni.kit.commands.execute("SwitchVariantPayloads", members=list(members), target=target)
+    after = resident_memory()
+    if before is not None and after is not None:
+        carb.log_info(
+            f"[xiaopeng.variant.switch] {key}: payloads of {target} loaded, "
+            f"resident memory {after / MB:.0f} MB ({(after - before) / MB:+.0f} MB)"
+        )
+
 
 class VisibilityModel(ui.AbstractValueModel):
     def __init__(self, path, visible):
@@ -20,7 +73,7 @@ class VisibilityModel(ui.AbstractValueModel):
 
     def get_value_as_bool(self) -> bool:
         """Reimplemented get bool"""
-        # Invisible when it's checked.
+        # Visible when it's checked.
         return self._value or False
 
     def get_value_as_string(self):
@@ -41,6 +94,13 @@ class VisibilityModel(ui.AbstractValueModel):
             "ChangeProperty", prop_path=Sdf.Path(prop_path), value='inherited' if value else 'invisible', prev=None
         )
         self._value_changed()
+
+    def update_value(self, value: bool):
+        """Set the value already authored on the stage, only notify when it changed"""
+        if self._value == value:
+            return
+        self._value = value
+        self._value_changed()
         
 class VariantSetModel(ui.AbstractItemModel):
     def __init__(self):
@@ -52,6 +112,20 @@ class VariantSetModel(ui.AbstractItemModel):
     def add_set(self, name):
         self._children.append(VariantSetItem(text=name))
         self._item_changed(None)
+
+    def replace_all(self, names):
+        """Replace every set with a single model notification"""
+        self._children = [VariantSetItem(text=name) for name in names]
+        self._item_changed(None)
+
+    def sync(self, names):
+        """Match the given set names, keeping the items of the sets that are still there"""
+        names = list(names)
+        if names == [_.get_value_as_string() for _ in self._children]:
+            return
+        items = {_.get_value_as_string(): _ for _ in self._children}
+        self._children = [items.get(name) or VariantSetItem(text=name) for name in names]
+        self._item_changed(None)
         
     
     def clear_set(self):
@@ -98,13 +172,15 @@ class VariantSetItem(ui.AbstractItem):
         return self.name_model.as_string
 
 class VariantItem(ui.AbstractItem):
-    """Single item of the model"""
+    """Single item of the model, identified by the path of the member prim"""
 
     def __init__(self, text, value, path):
         super().__init__()
         self.name_model = ui.SimpleStringModel(text)
         self.value_model = VisibilityModel(path, value)
         self.path = path
+        # Value changed subscription of the row showing this item, see EditableDelegate
+        self.value_subscription = None
     
     def __repr__(self):
         return f'"{self.name_model.get_value_as_string()} {self.value_model.get_value_as_bool()}"'
@@ -118,24 +194,75 @@ class VariantModel(ui.AbstractItemModel):
     It is used to make a single level tree appear like a simple list.
     """
 
-    def __init__(self):
+    def __init__(self, planner_fn=None, switch_layer_fn=None, unload_fn=None):
         super().__init__()
         self._children = []
+        # Member path -> item, a path is in a set at most once
+        self._index = {}
         self.parent_variant_set_path = None
+        self._planner_fn = planner_fn
+        # Returns the layer that receives the switch edits, None for the undoable edit target mode
+        self._switch_layer_fn = switch_layer_fn
+        # Returns True when the payloads of the inactive members are unloaded
+        self._unload_fn = unload_fn
         # for i in range(2):
         #     self._children.append(CommandItem(text='hello', value=True))
 
+    def _set_children(self, children):
+        self._children = children
+        self._index = {_.path: _ for _ in children}
+
+    def get_item(self, path):
+        """The item of a member path, or None"""
+        return self._index.get(path)
+
+    def get_paths(self):
+        """The member paths, in list order"""
+        return [_.path for _ in self._children]
+
     def add_item(self, name, value, path):
-        self._children.append(VariantItem(text=name, value=value, path=path))
+        self.add_items([(name, value, path)])
+
+    def add_items(self, entries):
+        """Append many (name, value, path) entries with a single model notification, known paths are skipped"""
+        for name, value, path in entries:
+            if path not in self._index:
+                item = VariantItem(text=name, value=value, path=path)
+                self._children.append(item)
+                self._index[path] = item
+        self._item_changed(None)
+
+    def replace_all(self, entries):
+        """Replace every item by (name, value, path) entries with a single model notification"""
+        self._set_children([VariantItem(text=name, value=value, path=path) for name, value, path in entries])
+        self._item_changed(None)
+
+    def sync(self, entries):
+        """Match the given (name, value, path) entries, keeping the items of the members that are still there"""
+        entries = list(entries)
+        if [_[2] for _ in entries] == self.get_paths():
+            return
+        children = []
+        for name, value, path in entries:
+            item = self._index.get(path)
+            if item:
+                item.value_model.update_value(value)
+            else:
+                item = VariantItem(text=name, value=value, path=path)
+            children.append(item)
+        self._set_children(children)
         self._item_changed(None)
 
     def clear_item(self):
-        self._children = []
+        self._set_children([])
         self._item_changed(None)
     
     def remove_item(self, items):
-        for item in items:
-            self._children.remove(item)
+        """Remove the items of the given items or member paths, in a single pass over the list"""
+        removed = {_ if isinstance(_, str) else _.path for _ in items}
+        for path in removed:
+            self._index.pop(path, None)
+        self._children = [_ for _ in self._children if _.path not in removed]
         self._item_changed(None)
 
     def get_item_children(self, item):
@@ -161,9 +288,18 @@ class VariantModel(ui.AbstractItemModel):
         if item and isinstance(item, VariantItem):
             return item.value_model if column_id == 1 else item.name_model
         
-    def set_variant_on(self, item):
+    @profile("variant_switcher.switch")
+    def set_variant_on(self, item, unload=None):
+        """Switch to the member of the item, unload overrides the unload_fn option"""
+        members = self.get_paths()
+        planner = self._planner_fn() if self._planner_fn else None
+        switch_layer = self._switch_layer_fn() if self._switch_layer_fn else None
+        if unload is None:
+            unload = self._unload_fn() if self._unload_fn else False
+        switch_variant(planner, self.parent_variant_set_path, members, item.path, switch_layer, unload)
+
         for child in self._children:
-            child.value_model.set_value(child == item)
+            child.value_model.update_value(child.path == item.path)
 
     def get_drag_mime_data(self, item):
         """Returns Multipurpose Internet Mail Extensions (MIME) data for be able to drop this item somewhere"""
@@ -177,6 +313,7 @@ class VariantModel(ui.AbstractItemModel):
         # don't want to create a tree.
         return not target_item and drop_location >= 0
 
+    @profile("variant_switcher.reorder")
     def drop(self, target_item, source, drop_location=-1):
         """Reimplemented from AbstractItemModel. Called when dropping something to the item."""
         try:
@@ -185,41 +322,21 @@ class VariantModel(ui.AbstractItemModel):
             # Not in the list. This is the source from another model.
             return
 
-        if source_id == drop_location:
+        # Index of the source once it's moved. Because when we remove the source,
+        # the array becomes shorter.
+        target_id = min(drop_location, len(self._children))
+        if source_id < target_id:
+            target_id -= 1
+
+        if source_id == target_id:
             # Nothing to do
             return
 
-        self._children.remove(source)
-
-        if drop_location > len(self._children):
-            # Drop it to the end
-            self._children.append(source)
-        else:
-            if source_id < drop_location:
-                # Because when we removed source, the array became shorter
-                drop_location = drop_location - 1
-
-            self._children.insert(drop_location, source)
-
+        self._children.insert(target_id, self._children.pop(source_id))
         self._item_changed(None)
-        
 
-        # delete all variant
-        stage = omni.usd.get_context().get_stage()
-        prim = stage.GetPrimAtPath(self.parent_variant_set_path)
-        cache_prims = [_.GetPath() for _ in prim.GetAllChildren()]
-
-        omni.kit.commands.execute('DeletePrims',
-            paths=cache_prims,
-            destructive=False)
-        
-        # rename
-
-        for i, child in enumerate(self._children):
-            path_name = '___'.join([_ for _ in child.path.split('/')])
-                
-            omni.kit.commands.execute('CreatePrimWithDefaultXform',
-                    prim_type='Scope',
-                    prim_path=f'{self.parent_variant_set_path}/{path_name}__num__{i}',
-                    attributes={},
-                    select_new_prim=False)
\ No newline at end of file
+        # Only the moved entry is recorded, the undo doesn't keep copies of the member list
+        omni.kit.commands.execute('MoveVariantSetMember',
+            set_path=self.parent_variant_set_path,
+            source_index=source_id,
+            target_index=target_id)
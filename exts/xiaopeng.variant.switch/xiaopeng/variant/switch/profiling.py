@@ -0,0 +1,128 @@
+import functools
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+try:
+    import carb.profiler as carb_profiler
+except ImportError:
+    # Outside of Kit only the in-process recorder is used
+    carb_profiler = None
+
+# carb profiler channel mask of the zones
+PROFILER_MASK = 1
+
+
+class Recorder:
+    """
+    In-process record of the duration of every span, by name and by label (e.g. the variant).
+    Recorders attached to another one also get what it records, e.g. the spans of one batch.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._durations: Dict[str, List[float]] = {}
+        self._labels: Dict[str, Dict[str, float]] = {}
+        self._attached: List["Recorder"] = []
+
+    def attach(self, other: "Recorder"):
+        with self._lock:
+            self._attached = self._attached + [other]
+
+    def detach(self, other: "Recorder"):
+        with self._lock:
+            self._attached = [_ for _ in self._attached if _ is not other]
+
+    def clear(self):
+        with self._lock:
+            self._durations = {}
+            self._labels = {}
+
+    def record(self, name: str, seconds: float, label: str = None):
+        with self._lock:
+            self._durations.setdefault(name, []).append(seconds)
+            if label is not None:
+                labels = self._labels.setdefault(name, {})
+                labels[label] = labels.get(label, 0.0) + seconds
+            attached = self._attached
+        for other in attached:
+            other.record(name, seconds, label)
+
+    def summary(self) -> Dict[str, dict]:
+        """count, total, p50, p95 and max in seconds per span name, plus the total per label"""
+        with self._lock:
+            durations = {name: sorted(values) for name, values in self._durations.items()}
+            labels = {name: dict(values) for name, values in self._labels.items()}
+
+        result = {}
+        for name, values in durations.items():
+            result[name] = {
+                "count": len(values),
+                "total": sum(values),
+                "p50": _percentile(values, 0.50),
+                "p95": _percentile(values, 0.95),
+                "max": values[-1],
+            }
+            if name in labels:
+                result[name]["labels"] = labels[name]
+        return result
+
+    def export(self, path: str):
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, indent=4)
+
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+recorder = Recorder()
+
+
+def resident_memory() -> Optional[int]:
+    """Resident memory of the process in bytes, None when it can't be read"""
+    if psutil:
+        return psutil.Process().memory_info().rss
+    try:
+        # Linux without psutil, the second field is the resident size in pages
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+@contextmanager
+def span(name: str, label: str = None):
+    """Time a block: a carb profiler zone when available, and always the in-process recorder"""
+    if carb_profiler:
+        carb_profiler.begin(PROFILER_MASK, name)
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        recorder.record(name, time.perf_counter() - start, label)
+        if carb_profiler:
+            carb_profiler.end(PROFILER_MASK)
+
+
+def profile(name: str):
+    """Decorator version of span"""
+
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
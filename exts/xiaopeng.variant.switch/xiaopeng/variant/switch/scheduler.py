@@ -0,0 +1,105 @@
+import time
+import carb
+import carb.settings
+from typing import List, NamedTuple
+from .profiling import recorder
+
+SETTINGS_PATH = "/exts/xiaopeng.variant.switch/batch"
+
+
+class VariantWait(NamedTuple):
+    name: str
+    seconds: float
+    frames: int
+    timed_out: bool
+
+
+class CaptureScheduler:
+    """
+    Decides when the viewport is ready to be captured after a variant switch.
+
+    The stage is considered settled when no USD files are still loading and the
+    renderer has converged (path tracing reached its sample count) for
+    `stable_frames` consecutive updates. `min_frames` is always waited and
+    `timeout` seconds is the upper bound.
+    """
+
+    def __init__(self, usd_context, viewport_api=None, min_frames=None, stable_frames=None, timeout=None):
+        settings = carb.settings.get_settings()
+        self._usd_context = usd_context
+        self._viewport_api = viewport_api
+        self.min_frames = min_frames if min_frames is not None else settings.get(f"{SETTINGS_PATH}/minFrames") or 0
+        self.stable_frames = (
+            stable_frames if stable_frames is not None else settings.get(f"{SETTINGS_PATH}/stableFrames") or 1
+        )
+        self.timeout = timeout if timeout is not None else settings.get(f"{SETTINGS_PATH}/timeoutSeconds") or 30.0
+
+        self.wait_times: List[VariantWait] = []
+        self._name = None
+        self._start = 0.0
+        self._frames = 0
+        self._stable = 0
+
+    def begin(self, name: str):
+        """Start waiting for a variant that was just switched on"""
+        self._name = name
+        self._start = time.perf_counter()
+        self._frames = 0
+        self._stable = 0
+
+    def poll(self) -> bool:
+        """Call once per update, returns True when the variant can be captured"""
+        self._frames += 1
+        elapsed = time.perf_counter() - self._start
+
+        if elapsed >= self.timeout:
+            self._finish(elapsed, True)
+            return True
+
+        if self._is_loading() or not self._is_converged():
+            self._stable = 0
+            return False
+
+        self._stable += 1
+        if self._frames >= self.min_frames and self._stable >= self.stable_frames:
+            self._finish(elapsed, False)
+            return True
+        return False
+
+    def summary(self) -> str:
+        if not self.wait_times:
+            return ""
+        total = sum(_.seconds for _ in self.wait_times)
+        slowest = max(self.wait_times, key=lambda _: _.seconds)
+        timed_out = sum(1 for _ in self.wait_times if _.timed_out)
+        return (
+            f"{len(self.wait_times)} variants, average wait {total / len(self.wait_times):.2f}s, "
+            f"slowest {slowest.name} {slowest.seconds:.2f}s, {timed_out} timed out"
+        )
+
+    def _finish(self, elapsed: float, timed_out: bool):
+        wait = VariantWait(self._name, elapsed, self._frames, timed_out)
+        self.wait_times.append(wait)
+        recorder.record("variant_switcher.batch.wait", elapsed, label=self._name)
+        carb.log_info(
+            f"[xiaopeng.variant.switch] {wait.name} ready after {wait.seconds:.2f}s / {wait.frames} frames"
+            + (" (timed out)" if timed_out else "")
+        )
+
+    def _is_loading(self) -> bool:
+        _, files_loaded, total_files = self._usd_context.get_stage_loading_status()
+        return files_loaded < total_files
+
+    def _is_converged(self) -> bool:
+        settings = carb.settings.get_settings()
+        if settings.get("/rtx/rendermode") != "PathTracing" or self._viewport_api is None:
+            # Real-time modes converge within a few frames, stable_frames covers them
+            return True
+
+        frame_info = getattr(self._viewport_api, "frame_info", None) or {}
+        subframes = frame_info.get("subframe_count")
+        total_spp = settings.get("/rtx/pathtracing/totalSpp")
+        if subframes is None or not total_spp:
+            return True
+        spp = settings.get("/rtx/pathtracing/spp") or 1
+        return subframes * spp >= total_spp
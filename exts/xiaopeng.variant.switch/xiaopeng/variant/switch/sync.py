@@ -0,0 +1,87 @@
+import asyncio
+import omni.kit.app
+from typing import Callable, Set
+from pxr import Usd, Sdf, Tf, UsdGeom
+from .cache import MEMBERS_ATTR
+
+
+class StageSync:
+    """
+    Watches the stage for edits of the variant switcher cache and of member
+    visibility, whoever makes them (undo, layer reload, other tools), and
+    reports them at most once per frame.
+
+    refresh_fn(sets_changed, changed_sets, visibility_paths, resynced_paths) gets:
+        sets_changed: the sets under the cache root may have been added, removed or renamed
+        changed_sets: names of the sets whose member list changed
+        visibility_paths: prims whose visibility attribute changed
+        resynced_paths: other resynced prims, the visibility of their descendants may have changed
+    """
+
+    def __init__(self, stage: Usd.Stage, cache_root: str, refresh_fn: Callable):
+        self.stage = stage
+        self.cache_root = Sdf.Path(cache_root)
+        self._refresh_fn = refresh_fn
+        self._listener = Tf.Notice.Register(Usd.Notice.ObjectsChanged, self._on_objects_changed, stage)
+        self._reset()
+
+    def destroy(self):
+        if self._listener:
+            self._listener.Revoke()
+            self._listener = None
+        self._refresh_fn = None
+        if self._flush_future:
+            self._flush_future.cancel()
+        self._reset()
+
+    def _reset(self):
+        self._sets_changed = False
+        self._changed_sets: Set[str] = set()
+        self._visibility_paths: Set[Sdf.Path] = set()
+        self._resynced_paths: Set[Sdf.Path] = set()
+        self._flush_future = None
+
+    def _set_name(self, path: Sdf.Path):
+        """Name of the set a path under the cache root belongs to"""
+        prefixes = path.GetPrefixes()
+        depth = self.cache_root.pathElementCount
+        return prefixes[depth].name if len(prefixes) > depth else None
+
+    def _on_objects_changed(self, notice, stage):
+        changed = False
+        for path in notice.GetResyncedPaths():
+            if path.HasPrefix(self.cache_root):
+                name = self._set_name(path.GetPrimPath())
+                if path.GetPrimPath() == self.cache_root or path.GetPrimPath().GetParentPath() == self.cache_root:
+                    self._sets_changed = True
+                if name:
+                    self._changed_sets.add(name)
+            elif self.cache_root.HasPrefix(path):
+                # An ancestor of the cache root, e.g. the pseudo root when a layer is reloaded
+                self._sets_changed = True
+                self._resynced_paths.add(path.GetPrimPath())
+            else:
+                self._resynced_paths.add(path.GetPrimPath())
+            changed = True
+
+        for path in notice.GetChangedInfoOnlyPaths():
+            if not path.IsPropertyPath():
+                continue
+            if path.name == UsdGeom.Tokens.visibility:
+                self._visibility_paths.add(path.GetPrimPath())
+                changed = True
+            elif path.name == MEMBERS_ATTR and path.GetPrimPath().GetParentPath() == self.cache_root:
+                self._changed_sets.add(path.GetPrimPath().name)
+                changed = True
+
+        if changed and self._flush_future is None:
+            self._flush_future = asyncio.ensure_future(self._flush_async())
+
+    async def _flush_async(self):
+        # Debounce: every change of this frame is applied once, on the next update
+        await omni.kit.app.get_app().next_update_async()
+        refresh_fn = self._refresh_fn
+        args = (self._sets_changed, self._changed_sets, self._visibility_paths, self._resynced_paths)
+        self._reset()
+        if refresh_fn:
+            refresh_fn(*args)
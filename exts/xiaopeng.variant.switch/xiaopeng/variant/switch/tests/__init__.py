@@ -1 +1,3 @@
-from .test_hello_world import *
\ No newline at end of file
+from .test_engine import *
+from .test_jobs import *
+from .test_thumbnails import *
@@ -0,0 +1,306 @@
+import os
+import tempfile
+import time
+import omni.kit.test
+from pxr import Usd, Sdf, UsdGeom
+
+from xiaopeng.variant.switch.commands import BakeVariantSetsCommand, MoveVariantSetMemberCommand
+from xiaopeng.variant.switch.commands import CommitSwitchLayerCommand
+from xiaopeng.variant.switch.commands import CreateVariantSetCommand, DeleteVariantSetsCommand, RenameVariantSetCommand
+from xiaopeng.variant.switch.engine import VariantEngine, SwitchLayer, PayloadPrefetcher, VisibilityCache
+from xiaopeng.variant.switch.engine import author_visibility, collect_members, commit_switch_layer
+from xiaopeng.variant.switch.engine import combination_count, gray_combination, iter_combinations
+from xiaopeng.variant.switch.manifest import BatchManifest, batch_hash, plan_steps
+
+
+class TestVariantEngine(omni.kit.test.AsyncTestCase):
+    async def setUp(self):
+        self._stage = Usd.Stage.CreateInMemory()
+        for i in range(3):
+            UsdGeom.Xform.Define(self._stage, f"/Car/Wheel{i}")
+        self._engine = VariantEngine(self._stage)
+        self._engine.create_set("Wheels", [f"/Car/Wheel{i}" for i in range(3)])
+
+    async def tearDown(self):
+        self._engine = None
+        self._stage = None
+
+    def _visibility(self, path):
+        return UsdGeom.Imageable(self._stage.GetPrimAtPath(path)).ComputeVisibility()
+
+    async def test_activate(self):
+        self._engine.activate("Wheels", "/Car/Wheel1")
+        self.assertEqual(self._visibility("/Car/Wheel0"), UsdGeom.Tokens.invisible)
+        self.assertEqual(self._visibility("/Car/Wheel1"), UsdGeom.Tokens.inherited)
+        self.assertEqual(self._visibility("/Car/Wheel2"), UsdGeom.Tokens.invisible)
+
+    async def test_activate_writes_only_changes(self):
+        self._engine.activate("Wheels", 0)
+        self.assertEqual(self._engine.activate("Wheels", 1), {"/Car/Wheel0": False, "/Car/Wheel1": True})
+        # Edits from elsewhere are taken into account
+        UsdGeom.Imageable(self._stage.GetPrimAtPath("/Car/Wheel2")).MakeVisible()
+        self.assertEqual(
+            self._engine.activate("Wheels", 0),
+            {"/Car/Wheel0": True, "/Car/Wheel1": False, "/Car/Wheel2": False}
+        )
+
+    async def test_reorder(self):
+        self._engine.reorder("Wheels", 0, 2)
+        self.assertEqual(self._engine.members("Wheels"), ["/Car/Wheel1", "/Car/Wheel2", "/Car/Wheel0"])
+
+    async def test_reorder_undo(self):
+        members = self._engine.members("Wheels")
+        command = MoveVariantSetMemberCommand(str(self._engine.set_path("Wheels")), 2, 0, stage=self._stage)
+        command.do()
+        self.assertEqual(self._engine.members("Wheels"), ["/Car/Wheel2", "/Car/Wheel0", "/Car/Wheel1"])
+        command.undo()
+        self.assertEqual(self._engine.members("Wheels"), members)
+
+    async def test_migrate_legacy(self):
+        self._stage.DefinePrim("/VariantSwitcherCache/Old/___Car___Wheel2__num__1", "Scope")
+        self._stage.DefinePrim("/VariantSwitcherCache/Old/___Car___Wheel0__num__0", "Scope")
+        sets = self._engine.load()
+        self.assertEqual(sets["Old"], ["/Car/Wheel0", "/Car/Wheel2"])
+        self.assertEqual(len(self._stage.GetPrimAtPath("/VariantSwitcherCache/Old").GetAllChildren()), 0)
+
+    async def test_add_members(self):
+        UsdGeom.Mesh.Define(self._stage, "/Car/Wheel0/Tire")
+        UsdGeom.Mesh.Define(self._stage, "/Car/Wheel3/Tire")
+        paths = collect_members(self._stage, ["/Car"], "Mesh")
+        self.assertEqual(paths, ["/Car/Wheel0/Tire", "/Car/Wheel3/Tire"])
+        self.assertEqual(self._engine.add_members("Wheels", ["/Car/Wheel0"] + paths), paths)
+        self.assertEqual(self._engine.add_members("Wheels", paths), [])
+        self.assertEqual(len(self._engine.members("Wheels")), 5)
+
+    async def test_is_free_name(self):
+        # Prims outside of the cache root don't reserve set names
+        self.assertTrue(self._engine.is_free_name("Car"))
+        self.assertFalse(self._engine.is_free_name("Wheels"))
+        self.assertFalse(self._engine.is_free_name("1"))
+        self._stage.DefinePrim("/Variant_1")
+        self.assertEqual(self._engine.next_free_name("Variant_"), "Variant_1")
+        self._engine.create_set("Variant_1")
+        self.assertEqual(self._engine.next_free_name("Variant_"), "Variant_2")
+
+    async def test_switch_layer(self):
+        switch_layer = SwitchLayer(self._stage)
+        author_visibility(switch_layer.edit_target, {"/Car/Wheel0": False})
+        self.assertEqual(self._visibility("/Car/Wheel0"), UsdGeom.Tokens.invisible)
+        self.assertFalse(self._stage.GetRootLayer().GetAttributeAtPath("/Car/Wheel0.visibility"))
+
+        commit_switch_layer(switch_layer, self._stage.GetEditTarget())
+        self.assertFalse(switch_layer.has_edits())
+        self.assertEqual(self._stage.GetRootLayer().GetAttributeAtPath("/Car/Wheel0.visibility").default, "invisible")
+        switch_layer.destroy()
+
+    async def test_commit_switch_layer_undo(self):
+        root_layer = self._stage.GetRootLayer()
+        author_visibility(self._stage.GetEditTarget(), {"/Car/Wheel1": False})
+        before = root_layer.ExportToString()
+        switch_layer = SwitchLayer(self._stage)
+        author_visibility(switch_layer.edit_target, {"/Car/Wheel0": False, "/Car/Wheel1": True})
+        switched = switch_layer.layer.ExportToString()
+
+        command = CommitSwitchLayerCommand(switch_layer, stage=self._stage)
+        command.do()
+        self.assertFalse(switch_layer.has_edits())
+        self.assertEqual(self._visibility("/Car/Wheel0"), UsdGeom.Tokens.invisible)
+        self.assertEqual(root_layer.GetAttributeAtPath("/Car/Wheel1.visibility").default, "inherited")
+        command.undo()
+        self.assertEqual(switch_layer.layer.ExportToString(), switched)
+        self.assertEqual(root_layer.ExportToString(), before)
+
+        # Once the session layer mode is off only the edit target is restored
+        command.do()
+        switch_layer.destroy()
+        command.undo()
+        self.assertEqual(root_layer.ExportToString(), before)
+
+    def _add_payloads(self):
+        heavy = Sdf.Layer.CreateAnonymous(".usda")
+        Sdf.CreatePrimInLayer(heavy, "/Heavy").specifier = Sdf.SpecifierDef
+        heavy.defaultPrim = "Heavy"
+        for i in range(3):
+            self._stage.GetPrimAtPath(f"/Car/Wheel{i}").GetPayloads().AddPayload(heavy.identifier)
+
+    def _add_payload_files(self, folder):
+        """A payload file per member, nothing loaded"""
+        files = []
+        for i, member in enumerate(self._engine.members("Wheels")):
+            files.append(os.path.join(folder, f"heavy{i}.usda"))
+            heavy = Sdf.Layer.CreateNew(files[-1])
+            Sdf.CreatePrimInLayer(heavy, "/Heavy").specifier = Sdf.SpecifierDef
+            heavy.defaultPrim = "Heavy"
+            heavy.Save()
+            self._stage.GetPrimAtPath(member).GetPayloads().AddPayload(files[-1])
+        self._stage.Unload()
+        return files
+
+    async def test_activate_unload(self):
+        self._add_payloads()
+        self._engine.activate("Wheels", 1, unload=True)
+        self.assertEqual(self._stage.GetLoadSet(), [Sdf.Path("/Car/Wheel1")])
+        self._engine.activate("Wheels", 2, unload=True)
+        self.assertEqual(self._stage.GetLoadSet(), [Sdf.Path("/Car/Wheel2")])
+
+    async def test_prefetch(self):
+        members = self._engine.members("Wheels")
+        with tempfile.TemporaryDirectory() as folder:
+            files = self._add_payload_files(folder)
+            prefetcher = PayloadPrefetcher(self._stage, max_members=2)
+            prefetcher.activate("Wheels", members, members[0])
+            self.assertEqual(self._stage.GetLoadSet(), [Sdf.Path(members[0])])
+
+            prefetcher.request(members[1:])
+            self.assertTrue(prefetcher.step())
+            self.assertTrue(prefetcher.step())
+            self.assertFalse(prefetcher.step())
+            for _ in range(200):
+                if prefetcher.is_ready(members[1]):
+                    break
+                time.sleep(0.01)
+            # Opened in the background, nothing is loaded on the stage yet
+            self.assertTrue(Sdf.Layer.Find(files[1]))
+            self.assertEqual(self._stage.GetLoadSet(), [Sdf.Path(members[0])])
+
+            prefetcher.activate("Wheels", members, members[1])
+            self.assertEqual(self._stage.GetLoadSet(), [Sdf.Path(members[1])])
+            # The active member and the one not activated yet are kept
+            prefetcher.request(members[:1])
+            self.assertFalse(prefetcher.step())
+            prefetcher.activate("Wheels", members, members[2])
+            self.assertTrue(prefetcher.step())
+            self.assertFalse(prefetcher.is_ready(members[1]))
+            prefetcher.destroy()
+            self._stage.Unload()
+
+    async def test_manifest_skips_unchanged(self):
+        sets = {"Wheels": self._engine.members("Wheels")}
+        with tempfile.TemporaryDirectory() as folder:
+            base_hash = batch_hash(self._stage, sets)
+            manifest = BatchManifest(folder)
+            first = next(plan_steps(sets, 0, base_hash, manifest))
+            path = os.path.join(folder, first.name + ".png")
+            open(path, "wb").close()
+            manifest.expect(path, first.digest)
+            manifest.record([path])
+            manifest.flush()
+
+            done = [_.done for _ in plan_steps(sets, 0, base_hash, BatchManifest(folder))]
+            self.assertEqual(done, [True, False, False])
+            render_settings = {"/rtx/rendermode": "PathTracing"}
+            self.assertNotEqual(batch_hash(self._stage, sets, render_settings=render_settings), base_hash)
+
+    async def test_bake(self):
+        self._engine.activate("Wheels", 1)
+        self._engine.bake("/Car")
+        variant_set = self._stage.GetPrimAtPath("/Car").GetVariantSets().GetVariantSet("Wheels")
+        self.assertEqual(variant_set.GetVariantNames(), ["Wheel0", "Wheel1", "Wheel2"])
+        # The visible member is selected and the local opinions are gone
+        self.assertEqual(variant_set.GetVariantSelection(), "Wheel1")
+        self.assertFalse(self._stage.GetRootLayer().GetAttributeAtPath("/Car/Wheel0.visibility"))
+        self.assertEqual(self._visibility("/Car/Wheel0"), UsdGeom.Tokens.invisible)
+        variant_set.SetVariantSelection("Wheel2")
+        self.assertEqual(self._visibility("/Car/Wheel1"), UsdGeom.Tokens.invisible)
+        self.assertEqual(self._visibility("/Car/Wheel2"), UsdGeom.Tokens.inherited)
+
+    async def test_bake_undo(self):
+        self._engine.activate("Wheels", 1)
+        # A variant set the bake doesn't author is kept as it is
+        trim = self._stage.GetPrimAtPath("/Car").GetVariantSets().AddVariantSet("Trim")
+        trim.AddVariant("Sport")
+        trim.SetVariantSelection("Sport")
+        layer = self._stage.GetRootLayer()
+        before = layer.ExportToString()
+        command = BakeVariantSetsCommand({"Wheels": self._engine.members("Wheels")}, "/Car", stage=self._stage)
+        command.do()
+        self.assertTrue(self._stage.GetPrimAtPath("/Car").GetVariantSets().HasVariantSet("Wheels"))
+        command.undo()
+        self.assertEqual(layer.ExportToString(), before)
+
+        # The target specs created in a layer without opinion on the target are removed
+        session_layer = self._stage.GetSessionLayer()
+        self._stage.SetEditTarget(session_layer)
+        command = BakeVariantSetsCommand({"Wheels": self._engine.members("Wheels")}, "/Car", stage=self._stage)
+        command.do()
+        self.assertTrue(session_layer.GetPrimAtPath("/Car"))
+        command.undo()
+        self.assertFalse(session_layer.GetPrimAtPath("/Car"))
+        self.assertEqual(layer.ExportToString(), before)
+
+    async def test_cache_edit_undo(self):
+        layer = self._stage.GetRootLayer()
+        wheels = self._engine.members("Wheels")
+        before = layer.ExportToString()
+        commands = [
+            (CreateVariantSetCommand("Paint", ["/Car/Wheel0"], stage=self._stage), ["Wheels", "Paint"]),
+            (RenameVariantSetCommand("Wheels", "Tires", stage=self._stage), ["Tires"]),
+            (DeleteVariantSetsCommand(["Wheels"], remove_empty_root=True, stage=self._stage), []),
+        ]
+        for command, sets in commands:
+            command.do()
+            self.assertEqual(self._engine.list_sets(), sets)
+            command.undo()
+            self.assertEqual(self._engine.list_sets(), ["Wheels"])
+            self.assertEqual(self._engine.members("Wheels"), wheels)
+            self.assertEqual(layer.ExportToString(), before)
+
+        # Without a cache root, undo removes the one the command created
+        DeleteVariantSetsCommand(["Wheels"], remove_empty_root=True, stage=self._stage).do()
+        command = CreateVariantSetCommand("Paint", stage=self._stage)
+        command.do()
+        self.assertEqual(self._engine.list_sets(), ["Paint"])
+        command.undo()
+        self.assertFalse(self._stage.GetPrimAtPath(self._engine.cache_root))
+
+    async def test_gray_combination(self):
+        sizes = [3, 2, 4]
+        combinations = [gray_combination(i, sizes) for i in range(combination_count(sizes))]
+        self.assertEqual(len(set(combinations)), 24)
+        for previous, combination in zip(combinations, combinations[1:]):
+            self.assertEqual(sum(a != b for a, b in zip(previous, combination)), 1)
+
+    async def test_combination_names(self):
+        # Members with the same prim name write different files
+        sets = {"Wheels": ["/Car/A/Wheel", "/Car/B/Wheel"], "Paint": ["/Car/Red", "/Car/Blue"]}
+        steps = list(iter_combinations(sets))
+        self.assertEqual(len({name for _, name, _ in steps}), 4)
+        self.assertEqual([len(switches) for _, _, switches in steps], [2, 1, 1, 1])
+        self.assertEqual([name for _, name, _ in iter_combinations({"Wheels": sets["Wheels"]})], ["Wheel", "Wheel_1"])
+
+    async def test_visibility_cache(self):
+        cache = VisibilityCache(self._stage)
+        members = self._engine.members("Wheels")
+        self.assertEqual(cache.get_many(members), {path: True for path in members})
+        # An edit on an ancestor invalidates the cached descendants
+        car = UsdGeom.Imageable(self._stage.GetPrimAtPath("/Car"))
+        car.MakeInvisible()
+        self.assertEqual(cache.get_many(members), {path: False for path in members})
+        car.MakeVisible()
+        self.assertTrue(cache.get("/Car/Wheel1"))
+        # Many paths changed in one notice are invalidated together
+        author_visibility(self._stage.GetEditTarget(), {"/Car/Wheel0": False, "/Car/Wheel2": False})
+        self.assertEqual(cache.get_many(members), {"/Car/Wheel0": False, "/Car/Wheel1": True, "/Car/Wheel2": False})
+        self._stage.GetPrimAtPath("/Car").SetActive(False)
+        self.assertFalse(cache.get("/Car/Wheel1"))
+        cache.destroy()
+
+    async def test_batch_hash_ignores_loaded_payloads(self):
+        sets = {"Wheels": self._engine.members("Wheels")}
+        with tempfile.TemporaryDirectory() as folder:
+            files = self._add_payload_files(folder)
+            # "Unload Hidden" leaves a different member loaded from one run to the next
+            self._engine.activate("Wheels", 0, unload=True)
+            base_hash = batch_hash(self._stage, sets)
+            self._engine.activate("Wheels", 2, unload=True)
+            self.assertEqual(batch_hash(self._stage, sets), base_hash)
+            self._stage.Unload()
+            self.assertEqual(batch_hash(self._stage, sets), base_hash)
+
+            # An edit of a payload file is seen, loaded or not
+            heavy = Sdf.Layer.FindOrOpen(files[1])
+            Sdf.CreatePrimInLayer(heavy, "/Heavy/Rim").specifier = Sdf.SpecifierDef
+            heavy.Save()
+            os.utime(files[1], (0, 0))
+            self.assertNotEqual(batch_hash(self._stage, sets), base_hash)
+            heavy = None
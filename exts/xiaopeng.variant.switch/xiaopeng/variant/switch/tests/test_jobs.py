@@ -0,0 +1,129 @@
+import asyncio
+import omni.kit.test
+
+from xiaopeng.variant.switch.jobs import Job, JobRunner, JobState
+
+
+class TestJobRunner(omni.kit.test.AsyncTestCase):
+    async def setUp(self):
+        self._runner = JobRunner()
+        self._states = []
+        self._runner.add_listener(lambda job: self._states.append((job.name, job.state)))
+
+    async def tearDown(self):
+        self._runner.destroy()
+        self._runner = None
+
+    async def _wait_for(self, condition):
+        for _ in range(100):
+            if condition():
+                return
+            await asyncio.sleep(0)
+        self.fail("condition not met")
+
+    def _steps_job(self, name, count=3):
+        """A job of `count` steps, a step runs each time the returned event is set"""
+        step = asyncio.Event()
+
+        async def run(job):
+            for i in range(count):
+                await job.checkpoint()
+                await step.wait()
+                step.clear()
+                job.set_progress((i + 1) / count)
+
+        return Job(name, run), step
+
+    async def test_run_in_order(self):
+        first, first_step = self._steps_job("first", 1)
+        second, second_step = self._steps_job("second", 1)
+        self._runner.submit(first)
+        self._runner.submit(second)
+        await self._wait_for(lambda: first.state == JobState.RUNNING)
+        self.assertEqual(self._runner.queued, [second])
+        first_step.set()
+        await self._wait_for(lambda: second.state == JobState.RUNNING)
+        self.assertEqual(first.state, JobState.DONE)
+        second_step.set()
+        await self._wait_for(lambda: not self._runner.busy)
+        self.assertEqual(second.state, JobState.DONE)
+        self.assertEqual(second.progress, 1.0)
+
+    async def test_pause_resume(self):
+        job, step = self._steps_job("job")
+        self._runner.submit(job)
+        await self._wait_for(lambda: job.state == JobState.RUNNING)
+        self._runner.pause()
+        step.set()
+        # The step in progress ends, the job then waits at its checkpoint
+        await self._wait_for(lambda: job.progress > 0)
+        step.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+        self.assertEqual(job.state, JobState.PAUSED)
+        self.assertAlmostEqual(job.progress, 1 / 3)
+
+        self._runner.resume()
+        await self._wait_for(lambda: job.progress > 0.5)
+        step.set()
+        await self._wait_for(lambda: job.state == JobState.DONE)
+        # set_progress notifies as well, the repeated states are left out
+        states = [state for _, state in self._states]
+        transitions = [state for i, state in enumerate(states) if i == 0 or states[i - 1] != state]
+        self.assertEqual(
+            transitions, [JobState.QUEUED, JobState.RUNNING, JobState.PAUSED, JobState.RUNNING, JobState.DONE])
+
+    async def test_cancel(self):
+        running, step = self._steps_job("running")
+        queued, _ = self._steps_job("queued")
+        last, last_step = self._steps_job("last", 1)
+        for job in [running, queued, last]:
+            self._runner.submit(job)
+        await self._wait_for(lambda: running.state == JobState.RUNNING)
+
+        # A queued job is removed right away and never runs
+        self._runner.cancel(queued)
+        self.assertEqual(queued.state, JobState.CANCELLED)
+        self.assertEqual(self._runner.queued, [last])
+
+        # A paused job stops at its checkpoint, the next one runs
+        self._runner.pause()
+        step.set()
+        await self._wait_for(lambda: running.progress > 0)
+        self._runner.cancel()
+        await self._wait_for(lambda: last.state == JobState.RUNNING)
+        self.assertEqual(running.state, JobState.CANCELLED)
+        self.assertNotIn(("queued", JobState.RUNNING), self._states)
+        last_step.set()
+        await self._wait_for(lambda: last.state == JobState.DONE)
+
+    async def test_failure(self):
+        async def fail(job):
+            raise ValueError("no viewport")
+
+        failed = self._runner.submit(Job("failed", fail))
+        after, step = self._steps_job("after", 1)
+        self._runner.submit(after)
+        await self._wait_for(lambda: after.state == JobState.RUNNING)
+        self.assertEqual(failed.state, JobState.FAILED)
+        self.assertIsInstance(failed.error, ValueError)
+        # A failed job doesn't stop the queue
+        step.set()
+        await self._wait_for(lambda: after.state == JobState.DONE)
+        self.assertIsNone(after.error)
+
+    async def test_destroy(self):
+        blocked = asyncio.get_event_loop().create_future()
+
+        async def wait(job):
+            # No checkpoint, only the cancel of the runner task stops it
+            await blocked
+
+        running = self._runner.submit(Job("running", wait))
+        queued, _ = self._steps_job("queued")
+        self._runner.submit(queued)
+        await self._wait_for(lambda: running.state == JobState.RUNNING)
+        self._runner.destroy()
+        self.assertEqual(queued.state, JobState.CANCELLED)
+        await self._wait_for(lambda: running.state == JobState.CANCELLED)
+        self.assertFalse(self._runner.busy)
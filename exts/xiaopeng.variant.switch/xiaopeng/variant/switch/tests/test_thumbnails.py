@@ -0,0 +1,67 @@
+import os
+import tempfile
+import threading
+import omni.kit.test
+from PIL import Image
+
+from xiaopeng.variant.switch.thumbnails import ThumbnailCache
+
+
+class TestThumbnailCache(omni.kit.test.AsyncTestCase):
+    async def setUp(self):
+        self._folder = tempfile.TemporaryDirectory()
+        self._image_path = os.path.join(self._folder.name, "capture.png")
+        Image.new("RGB", (64, 32)).save(self._image_path)
+        self._caches = []
+
+    async def tearDown(self):
+        for cache in self._caches:
+            cache.destroy()
+        self._folder.cleanup()
+
+    def _create_cache(self):
+        cache = ThumbnailCache(os.path.join(self._folder.name, "thumbnails"), max_entries=2, width=16)
+        self._caches.append(cache)
+        return cache
+
+    def _add(self, cache, key):
+        done = threading.Event()
+        errors = []
+
+        def on_added(key, error):
+            errors.append(error)
+            done.set()
+
+        cache.add_from_image(key, self._image_path, done_fn=on_added)
+        self.assertTrue(done.wait(10))
+        self.assertEqual(errors, [None])
+
+    async def test_lru(self):
+        cache = self._create_cache()
+        for key in ["a", "b", "c"]:
+            self._add(cache, key)
+        # The least recent thumbnail is deleted
+        self.assertIsNone(cache.get("a"))
+        self.assertFalse(os.path.exists(cache.path("a")))
+        with Image.open(cache.get("c")) as image:
+            self.assertEqual(image.size, (16, 8))
+        # Reading "b" makes it the most recent one, "c" goes first
+        cache.get("b")
+        self._add(cache, "d")
+        self.assertIsNone(cache.get("c"))
+        self.assertTrue(cache.get("b"))
+
+    async def test_reload(self):
+        cache = self._create_cache()
+        self._add(cache, "a")
+        self._add(cache, "b")
+        # The file times of a previous session, "b" was read less recently than "a"
+        os.utime(cache.path("b"), (1000, 1000))
+        os.utime(cache.path("a"), (2000, 2000))
+        # A new session reads the order back from the folder
+        cache = self._create_cache()
+        self._add(cache, "c")
+        self.assertTrue(cache.get("a"))
+        self.assertTrue(cache.get("c"))
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(sorted(os.listdir(cache.folder)), ["a.png", "c.png"])
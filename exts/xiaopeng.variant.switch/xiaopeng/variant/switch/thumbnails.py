@@ -0,0 +1,103 @@
+import os
+import threading
+import carb
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+
+def _make_thumbnail(source: str, target: str, width: int, remove_source: bool):
+    from PIL import Image
+
+    with Image.open(source) as image:
+        height = max(1, round(image.height * width / image.width))
+        thumbnail = image.convert("RGBA").resize((width, height), Image.LANCZOS)
+    tmp_path = target + ".tmp.png"
+    thumbnail.save(tmp_path)
+    os.replace(tmp_path, target)
+    if remove_source:
+        os.remove(source)
+
+
+class ThumbnailCache:
+    """
+    Small images of the variants, stored in a folder as <variant state hash>.png.
+
+    The folder is an LRU cache of at most `max_entries` thumbnails: reading a
+    thumbnail makes it the most recent, the least recent ones are deleted.
+    Thumbnails are made from captured images by a worker thread.
+    """
+
+    def __init__(self, folder: str, max_entries: int = 1000, width: int = 128):
+        self.folder = folder
+        self.max_entries = max_entries
+        self.width = width
+        self._lock = threading.Lock()
+        self._entries = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="VariantThumbnail")
+
+    def destroy(self):
+        self._executor.shutdown(wait=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.folder, key + ".png")
+
+    def capture_path(self, key: str) -> str:
+        """Where to capture the full size image a thumbnail is made from, it is not a cache entry"""
+        os.makedirs(self.folder, exist_ok=True)
+        return os.path.join(self.folder, key + ".tmp.capture.png")
+
+    def get(self, key: str) -> Optional[str]:
+        """The thumbnail of a variant state, or None"""
+        with self._lock:
+            entries = self._load_entries()
+            if key not in entries:
+                return None
+            entries.move_to_end(key)
+        path = self.path(key)
+        try:
+            # The order of the files survives the session
+            os.utime(path)
+        except OSError:
+            pass
+        return path
+
+    def add_from_image(self, key: str, image_path: str, remove_source: bool = False, done_fn=None):
+        """
+        Make the thumbnail of a variant state from a captured image, in the background.
+        done_fn(key, error) is called once it is made or failed, from the worker thread.
+        """
+        os.makedirs(self.folder, exist_ok=True)
+        future = self._executor.submit(_make_thumbnail, image_path, self.path(key), self.width, remove_source)
+        future.add_done_callback(lambda f, key=key: self._added(key, f.exception(), done_fn))
+
+    def _added(self, key: str, error, done_fn=None):
+        if error is None:
+            self._add_entry(key)
+        else:
+            carb.log_warn(f"[xiaopeng.variant.switch] thumbnail {key} not made: {error}")
+        if done_fn:
+            done_fn(key, error)
+
+    def _add_entry(self, key: str):
+        with self._lock:
+            entries = self._load_entries()
+            entries[key] = None
+            entries.move_to_end(key)
+            evicted = []
+            while len(entries) > self.max_entries:
+                evicted.append(entries.popitem(last=False)[0])
+        for old_key in evicted:
+            try:
+                os.remove(self.path(old_key))
+            except OSError:
+                pass
+
+    def _load_entries(self) -> OrderedDict:
+        # The folder is listed once, oldest file first, then kept up to date in memory
+        if self._entries is None:
+            os.makedirs(self.folder, exist_ok=True)
+            files = [_ for _ in os.scandir(self.folder) if _.name.endswith(".png") and ".tmp" not in _.name]
+            files.sort(key=lambda _: _.stat().st_mtime)
+            self._entries = OrderedDict((_.name[:-len(".png")], None) for _ in files)
+        return self._entries
@@ -1,20 +1,45 @@
 import omni.ext
 import omni.ui as ui
 import omni.kit.commands
+import omni.kit.app
 import omni.usd
+import carb.settings
+import carb.tokens
 from typing import Union, List
 from pxr import Usd, Sdf, UsdGeom, UsdShade
 import os
+import asyncio
+from collections import deque
+from functools import partial
 from .style import STOP_BUTTON, BUTTON, STRING_FIELD, TOOL_BUTTON
 from omni.kit.widget.stage import StageWidget
 from omni.kit.widget.stage import StageIcons
 from .delegate import VariantSetEditableDelegate, EditableDelegate
-from .model import VariantItem, VariantModel, VariantSetItem, VariantSetModel  
+from .model import VariantItem, VariantModel, VariantSetItem, VariantSetModel, switch_variant, MB
+from .scheduler import CaptureScheduler, SETTINGS_PATH
+from .capture import CaptureWriter
+from .cache import is_legacy
+from .sync import StageSync
+from .jobs import Job, JobRunner, JobState
+from .manifest import BatchManifest, batch_hash, camera_state, plan_steps, variant_hash
+from .thumbnails import ThumbnailCache
+from .profiling import profile, span, recorder, resident_memory, Recorder
+from .engine import VariantEngine, SwitchPlanner, VisibilityCache, check_bake_target, combination_count
+from .engine import collect_members, merge_members, SwitchLayer, PayloadPrefetcher
 
 from omni.kit.window.filepicker import FilePickerDialog
 from omni.kit.widget.filebrowser import FileBrowserItem
 from omni.kit.window.popup_dialog import MessageDialog
-from omni.kit.viewport.utility import get_active_viewport, capture_viewport_to_file
+from omni.kit.viewport.utility import get_active_viewport
+
+# Default of the "Session Layer" check box: switch edits go to a session sublayer instead of the edit target
+SESSION_LAYER_SETTING = "/exts/xiaopeng.variant.switch/sessionLayer"
+# Default of the "Unload Hidden" check box: the payloads of the inactive members are unloaded
+UNLOAD_PAYLOADS_SETTING = "/exts/xiaopeng.variant.switch/unloadPayloads"
+THUMBNAILS_SETTINGS_PATH = "/exts/xiaopeng.variant.switch/thumbnails"
+# File written by "Export Profile", the latency of every operation since the extension started
+PROFILE_FILE_SETTING = "/exts/xiaopeng.variant.switch/profileFile"
+
 
 class VariantSwitchWindow(ui.Window):
     def __init__(self, title: str, delegate=None, **kwargs):
@@ -30,60 +55,499 @@ class VariantSwitchWindow(ui.Window):
         self._filepicker = None
         self._filepicker_selected_folder = ""
 
+        self._switch_planner = None
+        self._visibility_cache = None
+        self._stage_sync = None
+        self._switch_layer = None
+        self._session_layer_model = ui.SimpleBoolModel(
+            bool(carb.settings.get_settings().get(SESSION_LAYER_SETTING)))
+        self._session_layer_sub = self._session_layer_model.subscribe_value_changed_fn(
+            self._on_session_layer_toggled)
+        self._unload_model = ui.SimpleBoolModel(
+            bool(carb.settings.get_settings().get(UNLOAD_PAYLOADS_SETTING)))
+        self._stage_event_sub = self._usd_context.get_stage_event_stream().create_subscription_to_pop(
+            self._on_stage_event, name="VariantSwitcher stage event"
+        )
+
         self.frame.set_build_fn(self._build_fn)
 
-        self.add_frame_count = 0  # count the frame
-        self._wait_frame = False
-        self.current_switch_index = 0
-        self.start_batch = False
-        self.file_name = ""
-
-        self.subscription_handle = omni.kit.app.get_app().get_update_event_stream().create_subscription_to_pop(self.on_update, name="UPDATE_SUB")
-
-    def on_update(self, p):
-        if self.start_batch:
-            self._batch_progress_bar.visible = True
-            if self.add_frame_count > 0:
-                self.add_frame_count -= 1
-                if self.add_frame_count == 0:  
-                    path = os.path.join(self._filepicker_selected_folder, self.file_name)
-                    self.screenshot(path)
-                    self.current_switch_index += 1
-                    self._wait_frame = False
-                    self.add_frame_count = 0
-
-            elif not self._wait_frame and self.add_frame_count == 0:
-                items = self._variant_model._children
-                if self.current_switch_index < len(items):
-                    self._batch_progress_bar.model.set_value(self.current_switch_index / len(items))
-                    item = items[self.current_switch_index]
-                    self._variant_model.set_variant_on(item)
-                    self.file_name = item.name_model.get_value_as_string() + ".png"
-                    self._wait_frame = True
-                    self.add_frame_count = 500
-                else:
-                    self.start_batch = False
-                    self._batch_progress_bar.visible = False
-                    dialog = MessageDialog(
-                        title="Batch Render",
-                        message="Done",
-                        ok_handler=self._done_handler,
-                        ok_label="OK",
-                        disable_cancel_button=True
-                    )
-                    dialog.show()
+        # Batch screenshots run as jobs, one after the other
+        self._job_runner = JobRunner()
+        self._job_runner.add_listener(self._on_job_changed)
+
+        self._thumbnails = self._create_thumbnail_cache()
+        # Set name -> (camera and render state, hash of the state of the set but its active member),
+        # see get_thumbnail_key
+        self._thumbnail_bases = {}
+        self._thumbnail_task = None
+
+    async def _run_batch_async(self, job: Job, folder: str, sets, start: int):
+        """
+        capture every combination of the sets from `start`, each variant is captured once
+        the viewport is settled and the images are written in the background. Images whose
+        state didn't change since they were written, according to the manifest, are skipped
+        """
+        app = omni.kit.app.get_app()
+        # The profile exported with the images covers this batch only
+        batch_recorder = Recorder()
+        memory = resident_memory()
+        count = combination_count([len(_) for _ in sets.values()])
+        viewport_api = get_active_viewport()
+        scheduler = CaptureScheduler(self._usd_context, viewport_api)
+        writer = CaptureWriter()
+        manifest = BatchManifest(folder)
+
+        # Only the images of a single set have the key of a row, a combination never matches one
+        make_thumbnails = self._thumbnails is not None and len(sets) == 1
+
+        def record_written():
+            for path, digest in manifest.record(writer.take_written()):
+                if make_thumbnails:
+                    self._thumbnails.add_from_image(digest, path)
+
+        base_hash = batch_hash(
+            self._usd_context.get_stage(), sets, viewport_api.camera_path, self._get_render_state(viewport_api))
+        prefetcher, prefetch_count = self._create_prefetcher()
+        # The combinations are streamed, the product is never built in memory
+        steps = self._read_ahead(plan_steps(sets, start, base_hash, manifest), prefetch_count, prefetcher)
+        # Member switched on per set, skipped steps are never applied
+        applied = {}
+        skipped = 0
+        recorder.attach(batch_recorder)
+        try:
+            for step in steps:
+                await job.checkpoint()
+                job.set_progress(step.index / count, f"{step.name} ({step.index + 1}/{count})")
+                if step.done:
+                    skipped += 1
+                    continue
+
+                switches = {name: member for name, member in step.combination.items() if applied.get(name) != member}
+                with span("variant_switcher.batch.switch", label=step.name):
+                    self.switch_batch_step(switches, sets, prefetcher)
+                applied.update(switches)
+
+                scheduler.begin(step.name)
+                while True:
+                    await app.next_update_async()
+                    if await job.checkpoint():
+                        # The variant settles again after a pause
+                        scheduler.begin(step.name)
+                    if prefetcher:
+                        # The payload files of the upcoming variants are read in the background while this one renders
+                        with span("variant_switcher.batch.prefetch"):
+                            prefetcher.step()
+                    record_written()
+                    # Back pressure: keep the variant on screen until a writer slot is free
+                    if writer.can_accept() and scheduler.poll():
+                        break
+
+                path = os.path.join(folder, step.name + ".png")
+                manifest.expect(path, step.digest)
+                writer.capture(viewport_api, path)
+                while writer.capturing:
+                    await app.next_update_async()
+                    await job.checkpoint()
+                    writer.expire()
+
+            while writer.busy:
+                await app.next_update_async()
+                await job.checkpoint()
+                writer.expire()
+        finally:
+            if prefetcher:
+                prefetcher.destroy()
+            writer.destroy()
+            record_written()
+            manifest.flush()
+            recorder.detach(batch_recorder)
+            job.message = self._batch_summary(folder, scheduler, writer, batch_recorder, memory, skipped)
+
+    def _get_render_state(self, viewport_api) -> dict:
+        """
+        the render settings listed in batch.hashSettings and the viewport resolution, part of the image hash
+        """
+        settings = carb.settings.get_settings()
+        state = {path: settings.get(path) for path in settings.get(f"{SETTINGS_PATH}/hashSettings") or []}
+        state["resolution"] = list(viewport_api.resolution)
+        return state
+
+    def _create_prefetcher(self):
+        """
+        the payload prefetcher of a batch and how many variants it reads ahead, None when
+        "Unload Hidden" is off or prefetch is disabled
+        """
+        settings = carb.settings.get_settings()
+        prefetch_count = settings.get(f"{SETTINGS_PATH}/prefetchCount") or 0
+        if not self.is_unload_enabled() or prefetch_count <= 0:
+            return None, 0
+        prefetcher = PayloadPrefetcher(
+            self._usd_context.get_stage(),
+            max_members=settings.get(f"{SETTINGS_PATH}/prefetchMaxMembers") or 8,
+            memory_limit=(settings.get(f"{SETTINGS_PATH}/prefetchMemoryLimitMB") or 0) * MB,
+            memory_fn=resident_memory)
+        return prefetcher, prefetch_count
+
+    def _read_ahead(self, steps, count, prefetcher):
+        """
+        yield the batch steps, the members of the next `count` ones are queued for prefetch
+        """
+        lookahead = deque()
+        for step in steps:
+            lookahead.append(step)
+            if prefetcher and not step.done:
+                prefetcher.request(step.combination.values())
+            if len(lookahead) > count:
+                yield lookahead.popleft()
+        while lookahead:
+            yield lookahead.popleft()
+
+    def _batch_summary(self, folder, scheduler, writer, batch_recorder, memory_before, skipped=0):
+        message = scheduler.summary()
+        if skipped:
+            message += f"\n{skipped} unchanged, skipped"
+        if writer.errors:
+            failed = "\n".join(f"{os.path.basename(path)}: {error}" for path, error in writer.errors)
+            message += f"\n{len(writer.errors)} failed:\n{failed}"
+
+        memory = resident_memory()
+        if memory_before is not None and memory is not None:
+            message += f"\nResident memory: {memory_before / MB:.0f} MB before, {memory / MB:.0f} MB after"
+
+        profile_path = os.path.join(folder, "variant_switcher_profile.json")
+        try:
+            batch_recorder.export(profile_path)
+            message += f"\nProfile: {profile_path}"
+        except OSError as e:
+            message += f"\nProfile not written: {e}"
+        return message
+
+    def export_profile(self):
+        """
+        write the p50/p95/max latency of every operation since the extension started, batches included
+        """
+        path = carb.settings.get_settings().get(PROFILE_FILE_SETTING) or "${data}/variant_switcher_profile.json"
+        path = carb.tokens.get_tokens_interface().resolve(path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            recorder.export(path)
+        except OSError as e:
+            self._show_message("Export Profile", f"Profile not written: {e}")
+            return
+        self._show_message("Export Profile", f"Profile: {path}")
+
+    def _on_job_changed(self, job: Job):
+        queued = len(self._job_runner.queued)
+        active = job.state in (JobState.QUEUED, JobState.RUNNING, JobState.PAUSED) or queued > 0
+        self._batch_progress_bar.visible = active
+        self._pause_button.visible = active
+        self._cancel_button.visible = active
+        self._batch_status.visible = active
+        if job is self._job_runner.current and active:
+            self._batch_progress_bar.model.set_value(job.progress)
+            self._pause_button.text = "Resume" if job.state == JobState.PAUSED else "Pause"
+            status = f"{job.state.value}: {job.message}" if job.state == JobState.PAUSED else job.message
+            self._batch_status.text = status + (f" ({queued} queued)" if queued else "")
+
+        if job.state in (JobState.DONE, JobState.CANCELLED, JobState.FAILED) and self._thumbnails:
+            # Rebuild the visible rows, they show the thumbnails made meanwhile
+            self._variant_model._item_changed(None)
+
+        if job.state in (JobState.DONE, JobState.CANCELLED, JobState.FAILED) and job.message:
+            # A queued job that is cancelled before it starts has nothing to report
+            message = f"{job.state.value.capitalize()}\n{job.message}"
+            if job.error:
+                message += f"\n{job.error}"
+            self._show_message("Batch Render", message)
+
+    def _create_thumbnail_cache(self):
+        settings = carb.settings.get_settings()
+        if not settings.get(f"{THUMBNAILS_SETTINGS_PATH}/enabled"):
+            return None
+        folder = settings.get(f"{THUMBNAILS_SETTINGS_PATH}/folder") or "${data}/variant_switcher_thumbnails"
+        return ThumbnailCache(
+            carb.tokens.get_tokens_interface().resolve(folder),
+            max_entries=settings.get(f"{THUMBNAILS_SETTINGS_PATH}/maxEntries") or 1000,
+            width=settings.get(f"{THUMBNAILS_SETTINGS_PATH}/width") or 128)
+
+    def get_thumbnail_key(self, name, member):
+        """
+        hash of the state of the set `name` switched to `member`, the same as the image of a batch of that set alone.
+        None without a viewport
+        """
+        stage = self._usd_context.get_stage()
+        viewport_api = get_active_viewport()
+        if viewport_api is None:
+            return None
+        # The camera and the render settings change without any edit of the set
+        view = (camera_state(stage, viewport_api.camera_path), self._get_render_state(viewport_api))
+        cached = self._thumbnail_bases.get(name)
+        if cached is None or cached[0] != view:
+            if name == self.current_select_variant_name:
+                members = self._variant_model.get_paths()
+            else:
+                members = self.get_engine().members(name)
+            cached = (view, batch_hash(stage, {name: members}, viewport_api.camera_path, view[1]))
+            self._thumbnail_bases[name] = cached
+        return variant_hash(cached[1], {name: member})
+
+    def get_thumbnail(self, item):
+        """
+        thumbnail file of a member of the current set, None when there is none yet
+        """
+        if not self._thumbnails or not self.current_select_variant_name:
+            return None
+        key = self.get_thumbnail_key(self.current_select_variant_name, item.path)
+        return self._thumbnails.get(key) if key else None
+
+    def _on_variant_switched(self, item):
+        # The member is on screen, its thumbnail is captured if there is none. A batch makes its own.
+        name = self.current_select_variant_name
+        if not self._thumbnails or not name or self._job_runner.busy or get_active_viewport() is None:
+            return
+        if self.get_thumbnail(item) is not None:
+            return
+        if self._thumbnail_task:
+            # Only the member switched on last can still be captured
+            self._thumbnail_task.cancel()
+        self._thumbnail_task = asyncio.ensure_future(self._capture_thumbnail_async(name, item))
+
+    async def _capture_thumbnail_async(self, name, item):
+        """
+        capture the thumbnail of a member once the viewport is settled, unless another one was
+        switched on or a batch started meanwhile
+        """
+        def still_active():
+            return (
+                name == self.current_select_variant_name and item.value_model.get_value_as_bool()
+                and not self._job_runner.busy
+            )
+
+        app = omni.kit.app.get_app()
+        key = self.get_thumbnail_key(name, item.path)
+        viewport_api = get_active_viewport()
+        if key is None or viewport_api is None:
+            return
+        scheduler = CaptureScheduler(self._usd_context, viewport_api)
+        scheduler.begin(item.name_model.as_string)
+        while still_active() and not scheduler.poll():
+            await app.next_update_async()
+        if not still_active():
+            return
+
+        path = self._thumbnails.capture_path(key)
+        writer = CaptureWriter(max_workers=1, max_pending=1)
+        try:
+            writer.capture(viewport_api, path)
+            while writer.busy:
+                await app.next_update_async()
+                writer.expire()
+        finally:
+            writer.destroy()
+        if path in writer.written:
+            loop = asyncio.get_event_loop()
+
+            def on_added(key, error):
+                # Called from the thumbnail worker, the row is rebuilt on the main thread
+                if error is None:
+                    loop.call_soon_threadsafe(self._on_thumbnail_added, item)
+
+            self._thumbnails.add_from_image(key, path, remove_source=True, done_fn=on_added)
+
+    def _on_thumbnail_added(self, item):
+        if self._thumbnails and self._variant_model.get_item(item.path) is item:
+            self._variant_model._item_changed(item)
+
+    def toggle_pause_batch(self):
+        job = self._job_runner.current
+        if job and job.state == JobState.PAUSED:
+            self._job_runner.resume()
+        else:
+            self._job_runner.pause()
+
+    def cancel_batch(self):
+        """
+        cancel the running batch and the queued ones
+        """
+        self._job_runner.cancel_all()
 
     def _done_handler(self, dialog):
         dialog.hide()
+
+    def _show_message(self, title, message):
+        dialog = MessageDialog(
+            title=title,
+            message=message,
+            ok_handler=self._done_handler,
+            ok_label="OK",
+            disable_cancel_button=True
+        )
+        dialog.show()
                     
 
     def destroy(self):
+        if self._job_runner:
+            self._job_runner.destroy()
+            self._job_runner = None
+        if self._thumbnail_task:
+            self._thumbnail_task.cancel()
+            self._thumbnail_task = None
+        if self._thumbnails:
+            self._thumbnails.destroy()
+            self._thumbnails = None
+        if self._switch_planner:
+            self._switch_planner.destroy()
+            self._switch_planner = None
+        if self._visibility_cache:
+            self._visibility_cache.destroy()
+            self._visibility_cache = None
+        if self._stage_sync:
+            self._stage_sync.destroy()
+            self._stage_sync = None
+        if self._switch_layer:
+            # Switches that were not committed are dropped with the layer
+            self._switch_layer.destroy()
+            self._switch_layer = None
+        self._session_layer_sub = None
+        self._stage_event_sub = None
         # It will destroy all the children
         super().destroy()
 
     def on_shutdown(self):
         self._win = None
-        self.subscription_handle = None
+
+    def get_switch_planner(self) -> SwitchPlanner:
+        """
+        get the switch planner of the current stage, it is kept for the life of the stage
+        """
+        stage = self._usd_context.get_stage()
+        if self._switch_planner is None or self._switch_planner.stage != stage:
+            if self._switch_planner:
+                self._switch_planner.destroy()
+            self._switch_planner = SwitchPlanner(stage)
+        return self._switch_planner
+
+    def get_visibility_cache(self) -> VisibilityCache:
+        """
+        get the visibility cache of the current stage, it is invalidated per path by change notices
+        """
+        stage = self._usd_context.get_stage()
+        if self._visibility_cache is None or self._visibility_cache.stage != stage:
+            if self._visibility_cache:
+                self._visibility_cache.destroy()
+            self._visibility_cache = VisibilityCache(stage)
+        return self._visibility_cache
+
+    def get_switch_layer(self) -> SwitchLayer:
+        """
+        get the session sublayer that receives the switch edits, None when "Session Layer" is off
+        """
+        stage = self._usd_context.get_stage()
+        if self._switch_layer and self._switch_layer.stage != stage:
+            # The layer went away with the session layer of its stage
+            self._switch_layer = None
+        if not self._session_layer_model.get_value_as_bool() or not stage:
+            return None
+        if self._switch_layer is None:
+            self._switch_layer = SwitchLayer(stage)
+        return self._switch_layer
+
+    def _on_session_layer_toggled(self, model):
+        if model.get_value_as_bool() or not self._switch_layer:
+            return
+        current = self._switch_layer.stage == self._usd_context.get_stage()
+        if current and self._switch_layer.has_edits():
+            # The layer is stronger than the edit target, left on the stage it would hide every later switch
+            model.set_value(True)
+            self._show_message("Session Layer", "Commit or revert the session layer switches before turning it off.")
+            return
+        if current:
+            self._switch_layer.destroy()
+        self._switch_layer = None
+
+    def is_unload_enabled(self) -> bool:
+        """
+        when "Unload Hidden" is on, a switch also unloads the payloads of the inactive members
+        """
+        return self._unload_model.get_value_as_bool()
+
+    def revert_switch_layer(self):
+        """
+        drop every switch made in the session layer, the asset is back to its own visibility
+        """
+        if self._switch_layer and self._switch_layer.stage == self._usd_context.get_stage():
+            self._switch_layer.revert()
+
+    def commit_switch_layer(self):
+        """
+        write the visibility of the session layer switches to the edit target, as one undoable command
+        """
+        if self._switch_layer and self._switch_layer.stage == self._usd_context.get_stage():
+            if self._switch_layer.has_edits():
+                omni.kit.commands.execute('CommitSwitchLayer', switch_layer=self._switch_layer)
+
+    def start_stage_sync(self):
+        """
+        follow the edits of the cache and of the member visibility made outside of the window
+        """
+        if self._stage_sync:
+            self._stage_sync.destroy()
+        stage = self._usd_context.get_stage()
+        cache_root = self.variant_set_path.model.get_value_as_string()
+        self._stage_sync = StageSync(stage, cache_root, self._on_stage_changed) if stage else None
+
+    def _on_stage_event(self, event):
+        if event.type == int(omni.usd.StageEventType.OPENED):
+            self.load_cache()
+        elif event.type == int(omni.usd.StageEventType.CLOSED):
+            if self._stage_sync:
+                self._stage_sync.destroy()
+                self._stage_sync = None
+            self._switch_layer = None
+            self._thumbnail_bases = {}
+        elif event.type == int(omni.usd.StageEventType.SAVED):
+            # The files are part of the thumbnail keys
+            self._thumbnail_bases = {}
+
+    @profile("variant_switcher.sync")
+    def _on_stage_changed(self, sets_changed, changed_sets, visibility_paths, resynced_paths):
+        engine = self.get_engine()
+        if sets_changed:
+            self._variant_set_model.sync(engine.list_sets())
+            if self.current_variant_set_selections:
+                # The selected set may have been renamed
+                name = self.current_variant_set_selections[0].get_value_as_string()
+                if engine.has_set(name):
+                    if name != self.current_select_variant_name:
+                        self.current_select_variant_name = name
+                        self._variant_model.parent_variant_set_path = str(engine.set_path(name))
+                        changed_sets.add(name)
+                else:
+                    self.current_select_variant_name = None
+                    self._variant_model.clear_item()
+
+        name = self.current_select_variant_name
+        for changed in changed_sets:
+            self._thumbnail_bases.pop(changed, None)
+        if name and name in changed_sets:
+            self._variant_model.sync(self.get_member_entries(engine.members(name)))
+
+        changed_paths = visibility_paths | resynced_paths
+        if changed_paths:
+            # Visibility is inherited, a change on any ancestor affects the member
+            for path in self._variant_model.get_paths():
+                if any(_ in changed_paths for _ in Sdf.Path(path).GetPrefixes()):
+                    self._variant_model.get_item(path).value_model.update_value(self.get_visible(path))
+
+    def get_engine(self) -> VariantEngine:
+        """
+        get the variant engine of the current stage and cache root
+        """
+        return VariantEngine(
+            self._usd_context.get_stage(),
+            self.variant_set_path.model.get_value_as_string(),
+            self.get_switch_planner()
+        )
 
     def show(self):
         self.visible = True
@@ -107,7 +571,24 @@ class VariantSwitchWindow(ui.Window):
                 
                 with ui.HStack(spacing=5, height=0):
                     ui.Button("Batch Screenshot", width=0, height=22, clicked_fn=self.show_screenshot_save_dir)
+                    ui.Label('Start', width=0)
+                    self._batch_start_field = ui.IntField(width=50, height=22)
+                    ui.Button("Bake Variant Sets", width=0, height=22, clicked_fn=self.bake_variant_sets)
                     self._batch_progress_bar = ui.ProgressBar(visible=False)
+                    self._batch_status = ui.Label("", width=0, visible=False)
+                    self._pause_button = ui.Button(
+                        "Pause", width=60, height=22, visible=False, clicked_fn=self.toggle_pause_batch)
+                    self._cancel_button = ui.Button(
+                        "Cancel", width=0, height=22, visible=False, style=STOP_BUTTON, clicked_fn=self.cancel_batch)
+
+                with ui.HStack(spacing=5, height=0):
+                    ui.CheckBox(self._session_layer_model, width=0)
+                    ui.Label('Session Layer', width=0)
+                    ui.Button("Revert", width=0, height=22, clicked_fn=self.revert_switch_layer)
+                    ui.Button("Commit", width=0, height=22, clicked_fn=self.commit_switch_layer)
+                    ui.CheckBox(self._unload_model, width=0)
+                    ui.Label('Unload Hidden', width=0)
+                    ui.Button("Export Profile", width=0, height=22, clicked_fn=self.export_profile)
                     
                 with ui.HStack(spacing=5):
                     
@@ -127,7 +608,7 @@ class VariantSwitchWindow(ui.Window):
                             vertical_scrollbar_policy=ui.ScrollBarPolicy.SCROLLBAR_AS_NEEDED,
                             style_type_name_override="TreeView",
                         ):
-                            self._variant_set_name_delegate = VariantSetEditableDelegate()
+                            self._variant_set_name_delegate = VariantSetEditableDelegate(self.get_engine)
                             self._variant_set_model = VariantSetModel()          
                             variant_set_tree_view = ui.TreeView(
                                 self._variant_set_model,
@@ -145,6 +626,9 @@ class VariantSwitchWindow(ui.Window):
                                 width=0,
                                 clicked_fn=self.add_group
                             )
+                            ui.Label(' Type ', width=0)
+                            # Empty adds the selected prims, a type name adds the prims of that type under them
+                            self._member_type_field = ui.StringField(width=80)
                             ui.Separator()
                             ui.Button(
                                 f" {omni.kit.ui.get_custom_glyph_code('${glyphs}/menu_delete.svg')}  Delete ", 
@@ -156,8 +640,10 @@ class VariantSwitchWindow(ui.Window):
                             vertical_scrollbar_policy=ui.ScrollBarPolicy.SCROLLBAR_AS_NEEDED,
                             style_type_name_override="TreeView",
                         ):
-                            self._name_value_delegate = EditableDelegate()
-                            self._variant_model = VariantModel()
+                            self._name_value_delegate = EditableDelegate(
+                                self.get_thumbnail if self._thumbnails else None, self._on_variant_switched)
+                            self._variant_model = VariantModel(
+                                self.get_switch_planner, self.get_switch_layer, self.is_unload_enabled)
                             self._varient_tree_view = ui.TreeView(
                                 self._variant_model,
                                 delegate=self._name_value_delegate,
@@ -168,9 +654,44 @@ class VariantSwitchWindow(ui.Window):
                                 drop_between_items=True,
                             )
 
+        if self._usd_context.get_stage():
+            self.load_cache()
+
+    def get_batch_sets(self):
+        """
+        the selected variant sets and their members, the batch renders every combination of them
+        """
+        if not self.current_variant_set_selections:
+            return {}
+        engine = self.get_engine()
+        sets = {}
+        for item in self.current_variant_set_selections:
+            name = item.get_value_as_string()
+            if name == self.current_select_variant_name:
+                sets[name] = self._variant_model.get_paths()
+            else:
+                sets[name] = engine.members(name)
+        return {name: members for name, members in sets.items() if members}
+
+    def switch_batch_step(self, switches, sets, prefetcher=None):
+        engine = self.get_engine()
+        # With prefetch the payloads are loaded and unloaded by the prefetcher
+        unload = self.is_unload_enabled() and not prefetcher
+        for name, member in switches.items():
+            if prefetcher:
+                prefetcher.activate(name, sets[name], member)
+            if name == self.current_select_variant_name:
+                # The set shown in the list, its check boxes follow
+                item = self._variant_model.get_item(member)
+                if item:
+                    self._variant_model.set_variant_on(item, unload)
+                    continue
+            switch_variant(
+                engine.planner, str(engine.set_path(name)), sets[name], member,
+                self.get_switch_layer(), unload)
+
     def show_screenshot_save_dir(self):
-        items = self._variant_model._children
-        if len(items) == 0:
+        if not self.get_batch_sets():
             dialog = MessageDialog(
                 title="Batch Render",
                 message="Please select a variant set!",
@@ -205,20 +726,15 @@ class VariantSwitchWindow(ui.Window):
 
     def _on_dir_pick(self, dialog: FilePickerDialog, filename: str, dirname: str):
         dialog.hide()
-        self.current_switch_index = 0
-        self.start_batch = True
-        # items = self._variant_model._children
-        # for item in items:
-        #     self._wait_frame = True
-        #     self._variant_model.set_variant_on(item)
-        #     file_name = item.name_model.get_value_as_string() + ".png"
-        #     path = os.path.join(self._filepicker_selected_folder, file_name)
-        #     self.screenshot(path)
-        #     print("screenshot" + file_name)
-
-    def screenshot(self, filename: str):
-        vp_api = get_active_viewport()
-        capture_viewport_to_file(vp_api, filename)
+        folder = self._filepicker_selected_folder
+        sets = self.get_batch_sets()
+        count = combination_count([len(_) for _ in sets.values()])
+        start = min(max(self._batch_start_field.model.get_value_as_int(), 0), count)
+        # The sets are read now, a batch queued behind another one renders what was selected
+        job = Job(
+            os.path.basename(folder) or folder,
+            partial(self._run_batch_async, folder=folder, sets=sets, start=start))
+        self._job_runner.submit(job)
 
 
     def variant_set_changed(self, selections):
@@ -233,75 +749,64 @@ class VariantSwitchWindow(ui.Window):
     def variant_changed(self, selections):
         self.current_variant_selections = selections
                 
+    @profile("variant_switcher.add_member")
     def add_group(self):
+        """
+        add the selected prims to the current set, or with a type filter the prims
+        of that type under the selection. Members already in the set are skipped
+        """
         if self.current_select_variant_name:
             paths = self._selection.get_selected_prim_paths()
             if paths:
-                path = str(paths[0])
-                name = path.split('/')[-1]
-
-                self.add_cache(path)
-                self._variant_model.add_item(name, self.get_visible(path), path)
-
-    def add_group_by_path(self, path):
-        name = path.split('/')[-1]
-        
-        self._variant_model.add_item(name, self.get_visible(path), path)
+                engine = self.get_engine()
+                type_name = self._member_type_field.model.get_value_as_string().strip()
+                members, added = merge_members(
+                    self._variant_model.get_paths(),
+                    collect_members(engine.stage, paths, type_name))
+                if not added:
+                    return
+
+                omni.kit.commands.execute('SetVariantSetMembers',
+                        set_path=str(engine.set_path(self.current_select_variant_name)),
+                        members=members)
+                self._variant_model.add_items(self.get_member_entries(added))
 
     def get_visible(self, prim_path):
-        stage = omni.usd.get_context().get_stage()
-        prim = stage.GetPrimAtPath(Sdf.Path(prim_path))
-        visibility_attribute = prim.GetAttribute("visibility")
-        return visibility_attribute.Get() == "invisible"
+        return self.get_visibility_cache().get(prim_path)
+
+    def get_member_entries(self, members):
+        """
+        (name, visible, path) of every member, to fill the variant model
+        """
+        visible = self.get_visibility_cache().get_many(members)
+        return [(path.split('/')[-1], visible[path], path) for path in members]
 
+    @profile("variant_switcher.load")
     def load_cache(self):
 
-        self._variant_set_model.clear_set()
         self._variant_model.clear_item()
 
         self._variant_set_name_delegate.variant_set_path = self.variant_set_path.model.get_value_as_string()
 
-        stage = omni.usd.get_context().get_stage()
-        prim = stage.GetPrimAtPath(Sdf.Path(self.variant_set_path.model.get_value_as_string()))
+        engine = self.get_engine()
+        prim = engine.stage.GetPrimAtPath(engine.cache_root)
 
-        if prim:
-            cache_prims = [_.GetName() for _ in prim.GetAllChildren()]
-            for cache_name in cache_prims:
-                self.add_variant_set_by_name(cache_name)
+        if prim and any(is_legacy(_) for _ in prim.GetAllChildren()):
+            omni.kit.commands.execute('MigrateVariantSets', cache_root=str(engine.cache_root))
+        # The sets already exist on the stage, only the model is filled
+        self._variant_set_model.replace_all(engine.list_sets())
+        # From now on the models follow the stage
+        self.start_stage_sync()
 
+    @profile("variant_switcher.load_set")
     def load_variant_set_cache(self, name):
-        stage = omni.usd.get_context().get_stage()
-        variant_set_path = f'{self.variant_set_path.model.get_value_as_string()}/{name}'
-        prim = stage.GetPrimAtPath(variant_set_path)
-
-        self._variant_model.clear_item()
-        self._variant_model.parent_variant_set_path = variant_set_path
-        cache_prims = [_.GetName() for _ in prim.GetAllChildren()]
-        for cache_name in cache_prims:
-            cache_name = cache_name.split('__num__')[0]
-            path = '/'.join(cache_name.split('___'))
-            self.add_group_by_path(path)
-
-
-    def add_cache(self, path):
-        if self.current_select_variant_name:
-            
-            path_name = '___'.join([_ for _ in path.split('/')])
-                
-            omni.kit.commands.execute('CreatePrimWithDefaultXform',
-                    prim_type='Scope',
-                    prim_path=f'{self.variant_set_path.model.get_value_as_string()}/{self.current_select_variant_name}/{path_name}__num__{len(self._variant_model._children)}',
-                    attributes={},
-                    select_new_prim=False)
-        
-            
-    def find_prims_by_name(self, prim_name: str):
-        stage = omni.usd.get_context().get_stage()
-        found_prims = [x for x in stage.Traverse() if x.GetName() == prim_name]
-        return found_prims
+        engine = self.get_engine()
 
+        self._variant_model.parent_variant_set_path = str(engine.set_path(name))
+        self._thumbnail_bases.pop(name, None)
+        members = engine.members(name)
+        self._variant_model.replace_all(self.get_member_entries(members))
 
-                
 
     def get_current_select_prim_path(self, multi=False):
         """
@@ -318,54 +823,74 @@ class VariantSwitchWindow(ui.Window):
             return paths[0] if len(paths) > 0 else None        
         return None
     
+    @profile("variant_switcher.add_set")
     def add_variant_set(self):
-        i = 1
-        while True:
-            name = f'Variant_{i}'
-            prims = self.find_prims_by_name(name)
-            if len(prims) == 0: 
-                self.add_variant_set_by_name(name)
-                break
-            i += 1
+        # Set names only have to be unique among the sets, as for a rename
+        name = self.get_engine().next_free_name('Variant_')
+        self.add_variant_set_by_name(name)
 
     def add_variant_set_by_name(self, name):
         self.add_variant_set_cache(name)
         self._variant_set_model.add_set(name)
 
     def add_variant_set_cache(self, name):
-        omni.kit.commands.execute('CreatePrimWithDefaultXform',
-            prim_type='Scope',
-            prim_path=self.variant_set_path.model.get_value_as_string(),
-            attributes={},
-            select_new_prim=False)
-            
-        omni.kit.commands.execute('CreatePrimWithDefaultXform',
-                prim_type='Scope',
-                prim_path=f'{self.variant_set_path.model.get_value_as_string()}/{name}',
-                attributes={},
-                select_new_prim=False)
+        omni.kit.commands.execute('CreateVariantSet',
+            name=name,
+            cache_root=self.variant_set_path.model.get_value_as_string())
         
+    @profile("variant_switcher.delete_set")
     def delete_selection_variant_set(self):
         if self.current_select_variant_name:
             self._variant_set_model.remove_set(self.current_variant_set_selections)
-            paths = [Sdf.Path(f'{self.variant_set_path.model.get_value_as_string()}/{_.get_value_as_string()}') for _ in self.current_variant_set_selections]
-            omni.kit.commands.execute('DeletePrims',
-                paths=paths,
-                destructive=False)
+            # The cache root goes with the last set
+            omni.kit.commands.execute('DeleteVariantSets',
+                names=[_.get_value_as_string() for _ in self.current_variant_set_selections],
+                remove_empty_root=True,
+                cache_root=self.variant_set_path.model.get_value_as_string())
             if len(self._variant_set_model._children) == 0:
-                omni.kit.commands.execute('DeletePrims',
-                    paths=[Sdf.Path(self.variant_set_path.model.get_value_as_string())],
-                    destructive=False)
                 self._variant_model.clear_item()
 
 
+    @profile("variant_switcher.delete_member")
     def delete_selection_variant(self):
         
         if self.current_select_variant_name:
             
-            paths = [Sdf.Path(f"{self.variant_set_path.model.get_value_as_string()}/{self.current_select_variant_name}/{'___'.join(_.get_path().split('/'))}__num__{self._variant_model._children.index(_)}") for _ in self.current_variant_selections]
-            omni.kit.commands.execute('DeletePrims',
-                paths=paths,
-                destructive=False)
-            
-            self._variant_model.remove_item(self.current_variant_selections)
+            # Members are identified by path, the stage list is filtered once whatever the selection size
+            removed = {_.get_path() for _ in self.current_variant_selections or ()}
+            if not removed:
+                return
+            members = [_ for _ in self._variant_model.get_paths() if _ not in removed]
+            omni.kit.commands.execute('SetVariantSetMembers',
+                set_path=str(self.get_engine().set_path(self.current_select_variant_name)),
+                members=members)
+
+            self._variant_model.remove_item(removed)
+
+    @profile("variant_switcher.bake")
+    def bake_variant_sets(self):
+        """
+        author the selected variant sets (all of them when none is selected) as native
+        USD variant sets on the prim selected in the stage
+        """
+        engine = self.get_engine()
+        target = self.get_current_select_prim_path()
+        if self.current_variant_set_selections:
+            names = [_.get_value_as_string() for _ in self.current_variant_set_selections]
+        else:
+            names = engine.list_sets()
+
+        if not target or not names:
+            self._show_message("Bake Variant Sets", "Please select the prim that receives the variant sets!")
+            return
+
+        sets = {name: engine.members(name) for name in names}
+        try:
+            check_bake_target(engine.stage, sets, target)
+        except ValueError as e:
+            self._show_message("Bake Variant Sets", str(e))
+            return
+
+        omni.kit.commands.execute('BakeVariantSets',
+            sets=sets,
+            target_path=str(target))